@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+import sys
+import numpy as np
+from time import time
+
+from eft_calculator import EFT_calculator
+import neighbor
+
+
+# A class that evaluates the total energy and the force and torque on each molecule 
+# of a cluster of rigid molecules, as a sum of pair contributions from an EFT_calculator.
+# The molecules are given by their centers of mass Xcom of shape (N, 3) and quaternions
+# q of shape (N, 4), e.g. as produced by Water.atomic2Xq. Pairs closer than the cutoff 
+# are found with a Verlet list and evaluated through the grid in batches of batch_size.
+# The cutoff defaults to, and cannot exceed, the largest r of the grid. For an 
+# orthorhombic periodic box, give its edge lengths in box.
+# With newton, each pair is queried once and the force and torque on the center
+# molecule are derived with EFT_calculator.eval_batch_both(), otherwise each pair is
+# queried a second time with the roles of the molecules swapped.
+class Cluster_calculator:
+    def __init__(self, eft, cutoff=None, batch_size=4096, skin=1.0, box=None, newton=True):
+        self.eft = eft
+        rmax = eft.grid.rs[-1]
+        if cutoff is None:
+            cutoff = rmax
+        if cutoff > rmax:
+            raise Exception('Cutoff %.2f beyond the grid range %.2f!' % (cutoff, rmax))
+        self.cutoff = cutoff
+        self.batch_size = batch_size
+        self.newton = newton
+        self.neighbors = neighbor.Verlet_list(cutoff, skin, box)
+        # statistics of the last call of eval()
+        self.npairs = 0
+        self.time = 0.
+
+    # Returns the total energy, the forces of shape (N, 3) and the torques 
+    # of shape (N, 3) about the center of mass of each molecule
+    def eval(self, Xcom, q):
+        t0 = time()
+        Xcom = np.asarray(Xcom, dtype=float)
+        q = np.asarray(q, dtype=float)
+        n = len(Xcom)
+        i, j, d = self.pairs(Xcom)
+        ener = 0.
+        force = np.zeros((n, 3))
+        torque = np.zeros((n, 3))
+        for start in range(0, len(i), self.batch_size):
+            bi = i[start:start+self.batch_size]
+            bj = j[start:start+self.batch_size]
+            # place j at the minimum image of i
+            Xi = Xcom[bi]
+            Xj = Xi + d[start:start+self.batch_size]
+            # j as the probe of center i
+            if self.newton:
+                eft, fti = self.eft.eval_batch_both(Xi, q[bi], Xj, q[bj])
+            else:
+                eft = self.eft.eval_batch(Xi, q[bi], Xj, q[bj])
+                # i as the probe of center j
+                fti = self.eft.eval_batch(Xj, q[bj], Xi, q[bi])[:, 1:7]
+            ener += eft[:, 0].sum()
+            self._accumulate(force, bj, eft[:, 1:4])
+            self._accumulate(torque, bj, eft[:, 4:7])
+            self._accumulate(force, bi, fti[:, 0:3])
+            self._accumulate(torque, bi, fti[:, 3:6])
+        self.npairs = len(i)
+        self.time = time() - t0
+        return ener, force, torque
+
+    # Index arrays i, j and displacements Xcom[j] - Xcom[i] of the pairs within the cutoff
+    def pairs(self, Xcom):
+        return self.neighbors.update(Xcom)
+
+    # Number of pairs evaluated per second in the last call of eval()
+    def rate(self):
+        if self.time == 0.:
+            return 0.
+        return self.npairs / self.time
+
+    def _accumulate(self, total, idx, values):
+        for k in range(values.shape[1]):
+            total[:, k] += np.bincount(idx, weights=values[:, k], minlength=len(total))
+
+
+# Rigid waters with random orientations on a cubic lattice of the given spacing
+def water_lattice(n, spacing=3.1, seed=0):
+    rng = np.random.RandomState(seed)
+    m = int(np.ceil(n ** (1. / 3)))
+    Xcom = np.array(list(np.ndindex(m, m, m))[:n], dtype=float) * spacing
+    q = rng.randn(n, 4)
+    q /= np.linalg.norm(q, axis=1)[:, None]
+    return Xcom, q
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("\n       Usage:#0 nmol [grid.dat order]\n")
+        sys.exit()
+    nmol = int(sys.argv[1])
+    order = 2
+    if len(sys.argv) > 3:
+        order = int(sys.argv[3])
+    calculator = EFT_calculator(order)
+    if len(sys.argv) > 2:
+        calculator.setup(sys.argv[2])
+    else:
+        calculator.setup()
+    cluster = Cluster_calculator(calculator)
+    Xcom, q = water_lattice(nmol)
+    ener, force, torque = cluster.eval(Xcom, q)
+    print('%d molecules, %d pairs, took %.2f s, %.0f pairs/s' % (nmol, cluster.npairs, cluster.time, cluster.rate()))
+    print('energy %f' % ener)
@@ -1,11 +1,34 @@
 #!/usr/bin/env python
 
+import os
+import re
+import errno
+import hashlib
+import gzip
 import numpy as np
 import itertools
+import multiprocessing
 
-from grid import Grid
+from grid import Grid, BIN_HEADER
 import tools
 
+# Regular expression for the point id in the name of a QM input or log file, 
+# e.g. eft.00001234.inp as written by gen_coors.py, or eft.00001234.log
+LOG_ID_PATTERN = r'eft\.(\d+)\.'
+
+# Layout of the mask files of the points filled in a binary database, see 
+# EFT_calculator.open_mask(). The header is followed by n bytes, 1 for filled points
+MASK_MAGIC = 'XQ2EFTMK'
+MASK_HEADER = np.dtype([('magic', 'S8'), ('n', '<i8'), ('digest', 'S32'), ('pad', 'S16')])
+
+# Layout of the QM input files written by gen_coors.py, INPUT_ROOT/EFT_%04d/eft.%08d.inp
+# with INPUT_FOLDER_SIZE points per folder
+INPUT_ROOT = 'conf.dat'
+INPUT_FOLDER_SIZE = 200
+
+# Name of the QM input file of grid point id, relative to root
+def input_name(id, root=INPUT_ROOT):
+    return os.path.join(root, "EFT_%04d" % (id // INPUT_FOLDER_SIZE), "eft.%08d.inp" % id)
 
 # A class that carries the logic of evaluating the energy, force and torque 
 # of a pair of rigid molecules. The coordinates of each molecule are given
@@ -28,39 +51,215 @@ class EFT_calculator:
         self.order = order # order of the interpolant, 1 for linear
 
     # Setup the grid structure. If provided with a data file, load it
-    def setup(self, filename=None):
+    # With rmin or rmax, only the r-shells needed for pairs with distances in 
+    # [rmin, rmax] are loaded, and with lazy each shell is loaded on first use. 
+    # max_mb bounds the megabytes of shells kept in memory, see Grid.load_bin()
+    # With dtype, e.g. np.float32, the y values are kept and interpolated in dtype
+    def setup(self, filename=None, rmin=None, rmax=None, lazy=False, max_mb=None, dtype=None):
         if not filename:
             self.grid.setup()
         else:
-            self.grid.load(filename) 
+            self.grid.load(filename, rmin=rmin, rmax=rmax, lazy=lazy, max_mb=max_mb) 
+        if dtype is not None:
+            self.grid.set_dtype(dtype)
 
     # Given a calculator that evalulates the atomic coordinates of a pair,
-    # use the results to fill the grid
-    def fill_grid(self, calculator, filename='grid_data.txt'):
-        def f(x):
-            coor = self._spherical2Atomic(x)
-            return calculator.eval(coor)
+    # use the results to fill the grid.
+    # With nproc > 1 or a chunk_dir, the grid points are split by id into chunks of 
+    # chunk_size points, which are evaluated by a pool of nproc processes. Each finished
+    # chunk is saved to chunk_dir (default: filename + '.chunks') right away, and chunks
+    # found there are loaded instead of evaluated, so an interrupted fill is resumed by 
+    # calling fill_grid again with the same arguments on the same grid setup. The setup 
+    # is recorded in chunk_dir/fingerprint.txt, and chunks of a different setup are refused
+    def fill_grid(self, calculator, filename='grid_data.txt', nproc=1, chunk_size=10000, chunk_dir=None):
         if not self.grid.n:
             raise Exception('setup() before fill')
-        self.grid.fill(f)
+        if nproc == 1 and chunk_dir is None:
+            for ids, xs in self._gen_id_chunks(chunk=chunk_size):
+                self.grid.y[ids] = self._eval_atomic(calculator, xs)
+        else:
+            if chunk_dir is None:
+                chunk_dir = filename + '.chunks'
+            self._fill_grid_chunks(calculator, nproc, chunk_size, chunk_dir)
         self.grid.save(filename)
 
-    def fill_with_QM(self, logfilelist):
-        """ input filename is a file with all gird GAMESS result log in order."""
-        loglist = open(logfilelist, 'r').readlines()
-        for i in range(len(loglist)):
-            loglist[i] = loglist[i].rstrip()
-        i = 0
-        for leaf, x in self.grid._gen_leaves_with_x():
-            leaf.y, coord = self._parseQMlog(loglist[i]) #coord is not using here
-            i += 1
-            if i >=len(loglist):break
+    # Description of a chunked fill, chunks of a fill with a different description
+    # cannot be reused
+    def _fill_fingerprint(self, calculator, chunk_size):
+        grid = self.grid
+        return ('n %d\nchunk_size %d\nang_params %s\nori_params %s\nrs %s\ncalculator %s\n' % (
+            grid.n, chunk_size, ' '.join('%r' % float(p) for p in grid.ang_params), 
+            ' '.join('%r' % float(p) for p in grid.ori_params), ' '.join('%r' % float(r) for r in grid.rs), 
+            calculator.__class__.__name__))
+
+    def _fill_grid_chunks(self, calculator, nproc, chunk_size, chunk_dir):
+        if not os.path.exists(chunk_dir):
+            os.makedirs(chunk_dir)
+        # chunks are only reused for the same grid, chunking and calculator
+        fingerprint = self._fill_fingerprint(calculator, chunk_size)
+        name = os.path.join(chunk_dir, 'fingerprint.txt')
+        if os.path.exists(name):
+            with open(name) as file:
+                if file.read() != fingerprint:
+                    raise Exception('Chunks in %s are from a different grid setup or calculator, '
+                                    'remove them or use another chunk_dir' % chunk_dir)
+        else:
+            if [f for f in os.listdir(chunk_dir) if f.startswith('chunk.')]:
+                raise Exception('Chunks in %s have no fingerprint, remove them or use another chunk_dir' % chunk_dir)
+            with open(name, 'w') as file:
+                file.write(fingerprint)
+        xs = self.grid.get_x()
+        tasks = []
+        for start in range(0, self.grid.n, chunk_size):
+            stop = min(start + chunk_size, self.grid.n)
+            name = os.path.join(chunk_dir, 'chunk.%08d.%08d.npy' % (start, stop))
+            if os.path.exists(name):
+                self.grid.y[start:stop] = np.load(name)
+            else:
+                tasks.append((start, stop, xs[start:stop], name))
+        nchunk = (self.grid.n - 1) // chunk_size + 1
+        print "%d of %d chunks to evaluate, %d found in %s" % (len(tasks), nchunk, nchunk - len(tasks), chunk_dir)
+        if nproc == 1:
+            _init_fill_worker(calculator)
+            results = itertools.imap(_fill_chunk, tasks)
+        else:
+            pool = multiprocessing.Pool(nproc, _init_fill_worker, (calculator,))
+            results = pool.imap_unordered(_fill_chunk, tasks)
+        for start, stop, ys in results:
+            self.grid.y[start:stop] = ys
+        if nproc != 1:
+            pool.close()
+            pool.join()
+
+    def fill_with_QM(self, logfilelist, id_pattern=LOG_ID_PATTERN):
+        """ input filename is a file with a list of gird GAMESS result logs. 
+        The grid point of each log is given by the id in its file name, see LOG_ID_PATTERN.
+        Only complete logs are used, like in harvest_QM(). Returns the number of logs used."""
+        loglist = self._read_loglist(logfilelist)
+        nbad = 0
+        for id, logname in zip(self._log_ids(loglist, id_pattern), loglist):
+            status, eft, coord = self._scanQMlog(logname) #coord is not using here
+            if status != 'done':
+                nbad += 1
+                continue
+            self.grid.y[id] = eft
+        if nbad:
+            print "%d logs not used as missing, failed or incomplete, see triage_QM()" % nbad
+        return len(loglist) - nbad
+
+    # Harvest the GAMESS logs listed in logfilelist with a pool of nproc processes and 
+    # write the EFTs into the binary grid database file (see Grid.save_bin()), keyed by 
+    # the point id in the file names. Only complete logs are ingested, and the database
+    # is created if it does not exist.
+    # The ids filled so far are recorded in the mask file database + '.mask', and logs 
+    # of ids already filled are skipped, so that results can be ingested incrementally
+    # as jobs finish. Returns the number of logs ingested
+    def harvest_QM(self, logfilelist, database, nproc=1, chunksize=64, id_pattern=LOG_ID_PATTERN, flush_every=10000):
+        loglist = self._read_loglist(logfilelist)
+        created = self._open_database(database)
+        # a mask left over from a removed database is discarded with it
+        mask = self.open_mask(database, fresh=created)
+        ids = self._log_ids(loglist, id_pattern)
+        todo = [(id, logname) for id, logname in zip(ids, loglist) if not mask[id]]
+        print "%d of %d logs to ingest, %d points filled before" % (len(todo), len(loglist), mask.sum())
+        lognames = [logname for id, logname in todo]
+        if nproc == 1:
+            results = itertools.imap(_harvest_log, lognames)
+        else:
+            pool = multiprocessing.Pool(nproc)
+            results = pool.imap(_harvest_log, lognames, chunksize)
+        nbad = 0
+        for k, (status, eft) in enumerate(results):
+            id = todo[k][0]
+            if status != 'done':
+                nbad += 1
+                continue
+            self.grid.y[id] = eft
+            mask[id] = True
+            if (k + 1) % flush_every == 0:
+                # the y values go to disk before the mask that marks them as done
+                self.grid.y.flush()
+                mask.flush()
+        if nproc != 1:
+            pool.close()
+            pool.join()
+        self.grid.y.flush()
+        mask.flush()
+        if nbad:
+            print "%d logs not ingested as missing, failed or incomplete, see triage_QM()" % nbad
+        return len(todo) - nbad
+
+    # Map the boolean mask of the grid points filled in the binary database, creating 
+    # it if needed, or anew with fresh. The mask file starts with a MASK_HEADER that 
+    # records n and a digest of the header of the database it belongs to, a mask of 
+    # another database is refused
+    def open_mask(self, database, mode='r+', fresh=False):
+        name = database + '.mask'
+        digest = self._database_digest(database)
+        if fresh or not os.path.exists(name):
+            header = np.zeros(1, dtype=MASK_HEADER)
+            header['magic'] = MASK_MAGIC
+            header['n'] = self.grid.n
+            header['digest'] = digest
+            with open(name, 'wb') as file:
+                file.write(header.tostring())
+                for start in range(0, self.grid.n, 2**20):
+                    file.write('\0' * min(2**20, self.grid.n - start))
+        with open(name, 'rb') as file:
+            header = np.fromfile(file, dtype=MASK_HEADER, count=1)
+        if (len(header) != 1 or header['magic'][0] != MASK_MAGIC or header['n'][0] != self.grid.n 
+                or header['digest'][0] != digest):
+            raise Exception('Mask file %s does not belong to %s, remove it to start over!' % (name, database))
+        return np.memmap(name, dtype=bool, mode=mode, offset=MASK_HEADER.itemsize, shape=(self.grid.n,))
+
+    # Map the binary database for writing, creating it for the current grid setup if needed.
+    # Returns whether the database was created
+    def _open_database(self, database):
+        created = not os.path.exists(database)
+        if created:
+            if not self.grid.n:
+                raise Exception('setup() before creating a database')
+            self.grid.save_bin(database)
+        self.grid.load_bin(database, mode='r+')
+        return created
+
+    # md5 digest of the header of a binary database, which covers n, the grid 
+    # parameters and the rs values
+    def _database_digest(self, database):
+        with open(database, 'rb') as file:
+            return hashlib.md5(file.read(BIN_HEADER.itemsize + 8 * len(self.grid.rs))).hexdigest()
+
+    def _read_loglist(self, logfilelist):
+        with open(logfilelist) as file:
+            return [line.strip() for line in file if line.strip()]
+
+    # Point ids encoded in the file names
+    def _log_ids(self, names, id_pattern=LOG_ID_PATTERN):
+        ids = []
+        for name in names:
+            match = re.search(id_pattern, os.path.basename(name))
+            if not match:
+                raise Exception('No point id in file name %s!' % name)
+            ids.append(int(match.group(1)))
+        ids = np.array(ids, dtype=int)
+        if len(ids) and (ids.min() < 0 or ids.max() >= self.grid.n):
+            raise Exception('Point id out of range of the grid!')
+        return ids
 
     def _parseQMlog(self, logname):
         """extract energy, force from GAMESS log file and 
         return (energy, force[0],force[1],force[2], torque[0],torque[1],torque[2])
         ni, nj is the atom num. of framgment i,j 
+        The log is read line by line and only up to the end of the gradient block.
         """
+        if not os.path.exists(logname):
+            raise IOError(errno.ENOENT, 'No such file or directory', logname)
+        status, eft, coords = self._scanQMlog(logname)
+        return eft, coords
+
+    # Classify a GAMESS log as 'done', 'missing', 'failed' (no E(MP2)=) or 'incomplete' 
+    # (no complete gradient block) without raising, together with the parse of _parseQMlog
+    def _scanQMlog(self, logname):
         AU2KCAL = 23.0605*27.2116
         HperB2toque = 1185.82 # 1Hartree/Bohr = 1185.82 kcal/mol/Angstrom
         frgE1 = -76.2987810745 * AU2KCAL
@@ -68,22 +267,34 @@ class EFT_calculator:
         e = 0.0
         f = np.zeros(3)
         t = np.zeros(3)
-        logf = open(logname, 'r')
-        log = logf.readlines()
-        logf.close()
+        if not os.path.exists(logname):
+            return 'missing', np.zeros(7), np.zeros((0, 3))
+        nE = 0
         coords = []
         gradients = []
-        for idx, i in enumerate(log):
-            if i[0:13] == " INPUT CARD> " and len(i.split()) == 7:
-                try:coords.append([float(i) for i in i.split()[4:7]])
-                except ValueError:continue
-            if 'E(MP2)=' in i : e = float(i.split()[1]) * AU2KCAL - frgE1 - frgE2
-            if 'GRADIENT OF THE ENERGY' in i: 
-                for gline in log[idx+4:idx+10]:
-                    gradients.append([float(g) * HperB2toque for g in gline.split()[2:5]])
-                break
+        with open(logname, 'r') as log:
+            for i in log:
+                if i[0:13] == " INPUT CARD> " and len(i.split()) == 7:
+                    try:coords.append([float(i) for i in i.split()[4:7]])
+                    except ValueError:continue
+                if 'E(MP2)=' in i : 
+                    e = float(i.split()[1]) * AU2KCAL - frgE1 - frgE2
+                    nE += 1
+                if 'GRADIENT OF THE ENERGY' in i: 
+                    for gline in itertools.islice(log, 3, 3 + self.mol.n1 + self.mol.n2):
+                        try:gradients.append([float(g) * HperB2toque for g in gline.split()[2:5]])
+                        except ValueError:break
+                    break
+        if not nE:
+            status = 'failed'
+        elif len(gradients) < self.mol.n1 + self.mol.n2 or min(len(g) for g in gradients) < 3:
+            status = 'incomplete'
+        else:
+            status = 'done'
         coords = np.array(coords)
         gradients = np.array(gradients)
+        if status != 'done' and (len(coords) < self.mol.n1 + self.mol.n2 or gradients.ndim != 2):
+            return status, np.array([e, 0., 0., 0., 0., 0., 0.]), coords
         # from com => probe
         com1 = self.mol.getCOM(coords[3:])
         coord1 = coords[:3]
@@ -91,7 +302,33 @@ class EFT_calculator:
         for idx in range(len(grad1)):
             f += grad1[idx]
             t += np.cross(coord1[idx] - com1, grad1[idx])
-        return np.array([e, f[0], f[1], f[2], t[0], t[1], t[2]]), coords
+        return status, np.array([e, f[0], f[1], f[2], t[0], t[1], t[2]]), coords
+
+    # Scan the GAMESS logs listed in logfilelist and classify every expected point id in 
+    # [start, stop) as 'done', 'missing', 'failed' or 'incomplete' (see _scanQMlog). Ids 
+    # without a log in the list are missing. Returns a dict of status => sorted id array
+    def triage_QM(self, logfilelist, start=None, stop=None, nproc=1, chunksize=256, id_pattern=LOG_ID_PATTERN):
+        start = 0 if start is None else start
+        stop = self.grid.n if stop is None else stop
+        loglist = self._read_loglist(logfilelist)
+        ids = self._log_ids(loglist, id_pattern)
+        keep = (ids >= start) & (ids < stop)
+        ids = ids[keep]
+        lognames = [logname for logname, k in zip(loglist, keep) if k]
+        if nproc == 1:
+            results = itertools.imap(_triage_log, lognames)
+        else:
+            pool = multiprocessing.Pool(nproc)
+            results = pool.imap(_triage_log, lognames, chunksize)
+        statuses = ('done', 'missing', 'failed', 'incomplete')
+        # later logs of the same id win, as in fill_with_QM
+        status = np.ones(stop - start, dtype=int) * statuses.index('missing')
+        for id, s in itertools.izip(ids, results):
+            status[id - start] = statuses.index(s)
+        if nproc != 1:
+            pool.close()
+            pool.join()
+        return dict((s, np.nonzero(status == k)[0] + start) for k, s in enumerate(statuses))
             
         
     # Evaluate the Xcom and q for a pair of mols by querying the grid
@@ -138,28 +375,160 @@ class EFT_calculator:
         torque[:] = np.dot(torque, R.T)
         return eft
 
+    # Evaluate N pairs at once. Xcom0, Xcom1 have shape (N, 3), q0, q1 have shape (N, 4).
+    # Carries out the same steps as eval() on whole arrays and returns an array of 
+    # shape (N, 7)
+    def eval_batch(self, Xcom0, q0, Xcom1, q1):
+        Xcom0, Xcom1 = np.atleast_2d(Xcom0, Xcom1)
+        q0, q1 = np.atleast_2d(q0, q1)
+        # move COM of mol0 to origin
+        X = Xcom1 - Xcom0
+        # reorient to align mol0 with refCoor
+        R = tools.q2R_batch(q0)
+        X = np.einsum('nj,nji->ni', X, R)
+        q = tools.qdiv_batch(q1, q0)
+        # Use mirror symmetry of mol0 to move mol1 such that its COM has positive y and z values
+        reflections = []
+        qsub = q[:, 1:]
+        for i in self.mol.refl_axes:
+            refl = X[:, i] < 0
+            X[refl, i] = -X[refl, i]
+            qsub[refl, i] = -qsub[refl, i]
+            qsub[refl] = -qsub[refl]
+            reflections.append((i, refl))
+        # Use mirror symmetry of mol1 to orient it such that it has positive q[0] and q[1] values
+        flip = q[:, 0] < 0
+        q[flip] = -q[flip]
+        flip = q[:, 1] < 0
+        q[flip] = q[flip][:, [1, 0, 3, 2]] * [-1., 1., 1., -1.]
+        # convert X, q to polar coordinates
+        r, phi, theta = tools.xyz2spherical_batch(X)
+        ophi1, ophi2, otheta = tools.q2spherical_batch(q)
+        coor = np.column_stack((r, phi, theta, ophi1, ophi2, otheta))
+        # use the grid to obtain results
+        eft = self.grid.interpolate_batch(coor, self.order)
+        force = eft[:, 1:4]
+        torque = eft[:, 4:7]
+        # Reverse the operations for mol0 mirror symmetry back
+        for i, refl in reflections:
+            force[refl, i] = -force[refl, i]
+            torque[refl, i] = -torque[refl, i]
+            torque[refl] = -torque[refl]
+        # Reverse the reorientation applied to align mol0 with refCoor
+        force[:] = np.einsum('nij,nj->ni', R, force)
+        torque[:] = np.einsum('nij,nj->ni', R, torque)
+        return eft
+
+    # Evaluate a pair like eval(), and derive the force on mol0 and its torque about 
+    # its own COM from the same result instead of a second query with mol1 as the center.
+    # By Newton's third law the force on mol0 is -F1, and since the total torque about any 
+    # point vanishes, the torque on mol0 is -T1 - (Xcom1 - Xcom0) x F1.
+    # Returns the EFT of mol1 as eval() does, and the force and torque of mol0 as an array
+    # of length 6
+    def eval_both(self, Xcom0, q0, Xcom1, q1):
+        eft, ft0 = self.eval_batch_both(Xcom0, q0, Xcom1, q1)
+        return eft[0], ft0[0]
+
+    # eval_both() for N pairs, returns arrays of shape (N, 7) and (N, 6)
+    def eval_batch_both(self, Xcom0, q0, Xcom1, q1):
+        eft = self.eval_batch(Xcom0, q0, Xcom1, q1)
+        d = np.atleast_2d(Xcom1) - np.atleast_2d(Xcom0)
+        force = eft[:, 1:4]
+        torque = eft[:, 4:7]
+        ft0 = np.empty((len(eft), 6))
+        ft0[:, 0:3] = -force
+        ft0[:, 3:6] = -torque - np.cross(d, force)
+        return eft, ft0
+
     # Generate atomic coordinates for mol pair for grid points along with
     # an id. The optional arguments can be used to specify a range for the id.
     # The coordinates are in the form of [XO0, XH0, XH0, XO1, XH1, XH1], where 0 indicates
     # the center molecule, 1 the probe molecule.
     def gen_atomic_coors(self, start=None, stop=None):
+        for ids, coors in self.gen_atomic_chunks(start, stop):
+            for i, c in zip(ids, coors):
+                yield i, c
+
+    # Generate chunks of ids in the range start, stop along with the atomic coordinates 
+    # of the pairs, an array of shape (N, 6, 3)
+    def gen_atomic_chunks(self, start=None, stop=None, chunk=10000):
+        for ids, xs in self._gen_id_chunks(start, stop, chunk):
+            yield ids, self._spherical2Atomic_batch(xs)
+
+    # Generate PDB strings for the given grid coordinates, or for the grid points in 
+    # the id range start, stop (all points by default) along with their ids
+    def gen_PDB(self, confs=None, start=None, stop=None):
+        for ids, xs in self._gen_conf_chunks(confs, start, stop):
+            #if np.linalg.norm(conf.q) > 1: pdb.set_trace()
+            for i, pdb in zip(ids, self._spherical2PDB_batch(ids, xs, model=False)):
+                yield i, pdb
+
+    # Write the conformations of gen_PDB() as MODEL/ENDMDL records of one PDB file, 
+    # gzip compressed if filename ends with .gz. With models_per_file, the models are
+    # split over files named like filename with a 4 digit index before the extension, 
+    # e.g. models.0000.pdb.gz. Returns the names of the files written
+    def write_PDB(self, filename, confs=None, start=None, stop=None, models_per_file=None):
+        names = []
+        out = None
+        nmodel = 0
+        for ids, xs in self._gen_conf_chunks(confs, start, stop):
+            models = self._spherical2PDB_batch(ids, xs)
+            while models:
+                if out is None:
+                    names.append(self._pdb_chunk_name(filename, len(names), models_per_file))
+                    out = self._open_out(names[-1])
+                    nmodel = 0
+                take = models_per_file - nmodel if models_per_file else len(models)
+                out.write(''.join(models[:take]))
+                nmodel += len(models[:take])
+                models = models[take:]
+                if nmodel == models_per_file:
+                    out.write("END\n")
+                    out.close()
+                    out = None
+        if out is not None:
+            out.write("END\n")
+            out.close()
+        return names
+
+    def _pdb_chunk_name(self, filename, index, models_per_file):
+        if not models_per_file:
+            return filename
+        root, ext = filename, ''
+        for suffix in ('.gz', '.pdb', '.ent'):
+            if root.endswith(suffix):
+                root, ext = root[:-len(suffix)], suffix + ext
+        return '%s.%04d%s' % (root, index, ext)
+
+    def _open_out(self, filename):
+        if filename.endswith('.gz'):
+            return gzip.open(filename, 'wb', compresslevel=6)
+        return open(filename, 'w')
+
+    # Generate chunks of ids along with the grid coordinates confs, or of the grid 
+    # points in the id range start, stop
+    def _gen_conf_chunks(self, confs=None, start=None, stop=None, chunk=10000):
+        if confs is None:
+            return self._gen_id_chunks(start, stop, chunk)
+        confs = np.asarray(list(confs), dtype=float).reshape(-1, 6)
+        return ((np.arange(first, min(first + chunk, len(confs))), confs[first:first+chunk]) 
+                for first in range(0, len(confs), chunk))
+
+    # Generate chunks of ids in the range start, stop along with the grid coordinates, 
+    # which are looked up directly by id so that a range can start anywhere in the grid
+    def _gen_id_chunks(self, start=None, stop=None, chunk=10000):
         if stop is None:
             if start is not None:
                 raise Exception('Specify start and stop at the same time!')
             start = 0
             stop = self.grid.n
-        gen_x = itertools.islice(self.grid.gen_x(), start, stop)
-        for i in range(start, stop):
-            x = gen_x.next()
-            coors = self._spherical2Atomic(x)
-            yield i, coors
-
-    def gen_PDB(self, confs=None):
-        if confs is None:confs=self.grid.gen_x()
-        for i, x in enumerate(confs):
-            #if np.linalg.norm(conf.q) > 1: pdb.set_trace()
-            coors = self._spherical2PDB(x)
-            yield i, coors
+        for first in range(start, stop, chunk):
+            last = min(first + chunk, stop)
+            yield np.arange(first, last), self.grid.get_x(first, last)
+
+    # Evaluate calculator on the atomic coordinates of the pairs at grid coordinates xs
+    def _eval_atomic(self, calculator, xs):
+        return np.array([calculator.eval(coors) for coors in self._spherical2Atomic_batch(xs)])
 
     # Construct atomic coordinates for a pair from grid coordinate
     def _spherical2Atomic(self, coor):
@@ -169,6 +538,17 @@ class EFT_calculator:
         coor = self.mol.Xq2Atomic(Xcom, q)
         return np.concatenate((self.mol.refCoor, coor), axis=0)
 
+    # _spherical2Atomic() for grid coordinates of shape (N, 6), returns an array of 
+    # shape (N, n1+n2, 3)
+    def _spherical2Atomic_batch(self, coors):
+        coors = np.asarray(coors, dtype=float).reshape(-1, 6)
+        Xcom = tools.spherical2xyz_batch(coors[:, 0], coors[:, 1], coors[:, 2])
+        q = tools.spherical2q_batch(coors[:, 3], coors[:, 4], coors[:, 5])
+        atoms = np.empty((len(coors), self.mol.n1 + self.mol.n2, 3))
+        atoms[:, :self.mol.n1] = self.mol.refCoor
+        atoms[:, self.mol.n1:] = self.mol.Xq2Atomic_batch(Xcom, q)
+        return atoms
+
     def _spherical2PDB(self, coor, NdxAtom=1,NdxRes=1):
         c= self._spherical2Atomic(coor)
         mol = 'TITLE para:' + '%8.3f'*6%tuple(coor) + '\n'
@@ -179,6 +559,54 @@ class EFT_calculator:
             NdxAtom += 1
         return mol
 
+    # PDB strings of the pairs at grid coordinates xs as _spherical2PDB() gives them, or
+    # with model as MODEL/ENDMDL records with the point ids as model serials. One 
+    # template is formatted per pair
+    def _spherical2PDB_batch(self, ids, xs, model=True):
+        if model:
+            lines = ['MODEL %8d', 'REMARK   1 para:' + '%8.3f'*6]
+        else:
+            lines = ['TITLE para:' + '%8.3f'*6]
+        NdxRes = 1
+        for i in range(self.mol.n1+self.mol.n2):
+            lines.append("ATOM  %5d%3s%6s A%4d%%12.3f%%8.3f%%8.3f  1.00  0.00" % (
+                i + 1, self.mol.ele[i], self.mol.frg, NdxRes))
+            if i + 1 == self.mol.n1:NdxRes += 1
+        lines.append('ENDMDL\n' if model else '')
+        template = '\n'.join(lines)
+        cs = self._spherical2Atomic_batch(xs).reshape(len(xs), -1)
+        values = np.concatenate((xs, cs), axis=1)
+        if model:
+            values = np.concatenate((np.asarray(ids, dtype=float)[:, np.newaxis], values), axis=1)
+        return [template % tuple(row) for row in values.tolist()]
+
+# State of the worker processes of EFT_calculator.fill_grid() and harvest_QM()
+_fill_state = {}
+
+def _init_fill_worker(calculator):
+    _fill_state['calculator'] = calculator
+    _fill_state['eft'] = EFT_calculator()
+
+# Evaluate a chunk of grid points, save the results and return them 
+def _fill_chunk(task):
+    start, stop, xs, name = task
+    calculator, eft = _fill_state['calculator'], _fill_state['eft']
+    ys = eft._eval_atomic(calculator, xs)
+    # write to a temporary file first so that an interrupted write is not taken as done
+    with open(name + '.tmp', 'wb') as file:
+        np.save(file, ys)
+    os.rename(name + '.tmp', name)
+    return start, stop, ys
+
+# Parse one GAMESS log for EFT_calculator.harvest_QM()
+def _harvest_log(logname):
+    if 'eft' not in _fill_state:
+        _fill_state['eft'] = EFT_calculator()
+    return _fill_state['eft']._scanQMlog(logname)[:2]
+
+def _triage_log(logname):
+    return _harvest_log(logname)[0]
+
 # A class that holds information related to the atomic structure of a water
 # molecule. It also includes several methods that carries out operations 
 # related to the atomic coordinates.
@@ -238,6 +666,31 @@ class Water:
         coor += Xcom
         return coor
 
+    # The following methods are the array versions of the methods above for N 
+    # molecules, with coors of shape (N, 3, 3), Xcom of shape (N, 3) and q of shape (N, 4)
+    def getR_batch(self, coors):
+        coors = np.asarray(coors, dtype=float)
+        coors = coors - coors[:, :1]
+        xvec = coors[:, 1] + coors[:, 2]
+        zvec = np.cross(coors[:, 1], coors[:, 2])
+        yvec = np.cross(zvec, xvec)
+        R = np.stack((xvec, yvec, zvec), axis=-1)
+        R /= np.linalg.norm(R, axis=1)[:, None, :]
+        return R
+
+    def getCOM_batch(self, coors):
+        return np.einsum('a,naj->nj', self.mass, coors) / self.mass.sum()
+
+    def atomic2Xq_batch(self, coors):
+        Xcom = self.getCOM_batch(coors)
+        R = self.getR_batch(coors)
+        q = tools.R2q_batch(R)
+        return Xcom, q
+
+    def Xq2Atomic_batch(self, Xcom, q):
+        R = tools.q2R_batch(q)
+        return np.einsum('aj,nij->nai', self.refCoor, R) + np.asarray(Xcom)[:, None]
+
 
 
 
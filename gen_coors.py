@@ -1,11 +1,20 @@
 #!/usr/bin/env python2
+# Usage: gen_coors.py [start stop] [--shards N [--nproc N]]
+# Without --shards one input file per grid point is written to conf.dat/EFT_%04d/ 
+# folders of 200 points. With --shards the inputs are packed in parallel into N tar 
+# archives of consecutive ids, conf.dat/eft.<first>-<stop>.tar, holding the same 
+# EFT_%04d/eft.%08d.inp members, and a manifest conf.dat/manifest.<start>-<stop>.txt 
+# with the id, shard, offset and size of each input in its shard
 import os,sys
-from eft_calculator import EFT_calculator
+import argparse
+import tarfile
+import multiprocessing
+from StringIO import StringIO
+import numpy as np
+from eft_calculator import EFT_calculator, INPUT_ROOT, input_name
 from mol2mol import * #GAMESS_Settings, WriteINP, WritePDB
-#  The coordinate structure of intermediate data is:
-#      [[elem, x, y, z],
-#       [elem, x, y, z],
-#       ...]
+#  The inputs are rendered in bulk by RenderINPs from the atomic coordinates of 
+#  a chunk of points, an array of shape (N, 6, 3) with the elements in ele
 ele = "OHHOHH"
 GAMESS_Settings="""! Gamess input file generated by gen_coors.py for HuaHe.
  $CONTRL SCFTYP=RHF RUNTYP=GRADIENT MPLEVL=2 $END
@@ -28,25 +37,62 @@ calculator.setup()
 # Please change the following code to whatever needed to generate the input 
 # coordinates files
 # Please make sure to carry the id number along with the results
-root = 'conf.dat'
+# An id range can be given as arguments (gen_coors.py start stop) to split the 
+# work among independent workers
+parser = argparse.ArgumentParser(description='Write the GAMESS inputs of the grid points')
+parser.add_argument('range', type=int, nargs='*', metavar='start stop', help='id range, all points by default')
+parser.add_argument('--shards', type=int, default=0, help='pack the inputs into this many tar archives')
+parser.add_argument('--nproc', type=int, default=multiprocessing.cpu_count(), help='processes writing shards')
+args = parser.parse_args()
+start, stop = 0, calculator.grid.n
+if len(args.range) == 2:
+    start, stop = args.range
+elif args.range:
+    parser.error('give both start and stop')
+if stop <= start:
+    parser.error('empty id range %d-%d' % (start, stop))
+if args.shards > stop - start:
+    parser.error('more shards than the %d ids of the range' % (stop - start))
+root = INPUT_ROOT
 if not os.path.exists(root):os.mkdir(root)
-def mol2mol_init(ele):
-    mol = [[i,0.0,0.0,0.0] for i in ele]
-    return mol
-size = 200
-folder_id = 0
-for id, coors in calculator.gen_atomic_coors(): 
+
+# Write the inputs of the ids first, last to a tar archive, returns the shard name
+# and the rows of its manifest
+def write_shard(ids):
+    first, last = ids
+    name = "eft.%08d-%08d.tar"%(first, last)
+    rows = []
+    tar = tarfile.open(os.path.join(root, name + ".tmp"), "w", format=tarfile.USTAR_FORMAT)
+    for ids, coors in calculator.gen_atomic_chunks(first, last):
+        for id, text in zip(ids, RenderINPs(coors, ele, GAMESS_Settings)):
+            info = tarfile.TarInfo(input_name(id, ''))
+            info.size = len(text)
+            # the data follows the 512 byte header of the member
+            rows.append((id, tar.offset + tarfile.BLOCKSIZE, info.size))
+            tar.addfile(info, StringIO(text))
+    tar.close()
+    os.rename(os.path.join(root, name + ".tmp"), os.path.join(root, name))
+    return name, rows
+
+if args.shards:
+    bounds = np.linspace(start, stop, args.shards + 1).astype(int)
+    tasks = [(first, last) for first, last in zip(bounds[:-1], bounds[1:]) if last > first]
+    pool = multiprocessing.Pool(min(args.nproc, len(tasks)))
+    with open(os.path.join(root, "manifest.%08d-%08d.txt"%(start, stop)), "w") as manifest:
+        manifest.write("# id shard offset size\n")
+        for name, rows in pool.imap(write_shard, tasks):
+            for id, offset, nbytes in rows:
+                manifest.write("%d %s %d %d\n"%(id, name, offset, nbytes))
+    pool.close()
+    pool.join()
+    sys.exit()
+
+for ids, coors in calculator.gen_atomic_chunks(start, stop): 
 #for id, coors in calculator.gen_atomic_coors(0,10): 
     #print id, coors
-    if id%size == 0:
-        folder = os.path.join(root,"EFT_%04d"%(folder_id))
+    for id, text in zip(ids, RenderINPs(coors, ele, GAMESS_Settings)):
+        folder = os.path.dirname(input_name(id, root))
         if not os.path.exists(folder):os.mkdir(folder)
-        folder_id += 1
-    mol = mol2mol_init(ele)
-    for i in range(len(coors)):
-        for j in range(3):
-            mol[i][j+1]=coors[i][j]
-    inf = open("%s/eft.%08d.inp"%(folder,id),"w")
-    WriteINP(inf, mol, GAMESS_Settings)
-    inf.close()
-
+        inf = open(input_name(id, root),"w")
+        inf.write(text)
+        inf.close()
@@ -1,5 +1,12 @@
 #!/usr/bin/env python2
+# Usage: gen_pdb.py [--out models.pdb.gz [--per-file N] [--all-points]]
+# The conformations of the translational grid (rotational coordinates set to zero)
+# are written. Without --out one PDB file per conformation is written to 
+# pdbRQ.dat/EFT_%04d/ folders of 200 files. With --out they are written as 
+# MODEL/ENDMDL records of one PDB file, gzip compressed for a .gz name, or of files
+# of N models. --all-points writes all grid points instead
 import os,sys
+import argparse
 from eft_calculator import EFT_calculator
 from mol2mol import * #GAMESS_Settings, WriteINP, WritePDB
 #  The coordinate structure of intermediate data is:
@@ -23,8 +30,20 @@ GAMESS_Settings="""! Gamess input file generated by gen_coors.py for HuaHe.
 C1
 """
 
+parser = argparse.ArgumentParser(description='Write the PDB conformations of the grid points')
+parser.add_argument('--out', help='multi-model PDB file to write')
+parser.add_argument('--per-file', type=int, help='models per file, the file index goes before the extension')
+parser.add_argument('--all-points', action='store_true', help='with --out, write all grid points instead of the translational grid')
+args = parser.parse_args()
 calculator = EFT_calculator()
 calculator.setup()
+confs =  calculator.grid.get_grid_x()
+if args.out:
+    if args.all_points:
+        confs = None
+    names = calculator.write_PDB(args.out, confs, models_per_file=args.per_file)
+    print('%d PDB files written: %s' % (len(names), ' '.join(names[:3]) + (' ...' if len(names) > 3 else '')))
+    sys.exit()
 # Please change the following code to whatever needed to generate the input 
 # coordinates files
 # Please make sure to carry the id number along with the results
@@ -36,7 +55,6 @@ def mol2mol_init(ele):
 size = 200
 folder_id = 0
 file_count = 0
-confs =  calculator.grid.gen_grid_x()
 for idx, coors in calculator.gen_PDB(confs): 
 #for id, coors in calculator.gen_atomic_coors(0,10): 
     #print(idx, coors)
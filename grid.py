@@ -1,94 +1,273 @@
 #!/usr/bin/env python
 
 import numpy as np
+import itertools
+from collections import OrderedDict
+
+# Layout of the binary grid database. The file starts with a fixed header, followed
+# by the RS values, then (after padding to a multiple of BIN_ALIGN bytes) the y values
+# of all grid points as one contiguous C-ordered n x 7 block of dtype ydtype.
+BIN_MAGIC = 'XQ2EFTDB'
+BIN_VERSION = 1
+BIN_ALIGN = 64
+BIN_HEADER = np.dtype([('magic', 'S8'), ('version', '<i4'), ('ydtype', 'S4'), 
+                       ('n', '<i8'), ('nrs', '<i8'), 
+                       ('ang_params', '<f8', 4), ('ori_params', '<f8', 4)])
 
 # A structure for a grid that discretizes six dimensions one by one.
 # The six dimensions are in the sequence of R, PHI, THETA for the translational space,
 # followed by PHI1, PHI2, THETA for the rotational space represented by the quaternion q.
-class Node:
-    def __init__(self, xs=[]):
-        self.xs = xs # for leaves, xs=[]
-        self.y = None # for leaves, y is a np-array
-        self.next = [] # for leaves, next=[] 
-
-    def count(self):
-        if not self.next:
-            return 1
+# The grid is stored flat, one Level per dimension. The 1D coordinate arrays of all
+# nodes on a level are stored back to back in xs, node m owns xs[starts[m]:starts[m+1]].
+# For every entry j on a level, child[j] is the node it leads to on the next level,
+# size[j] is the number of grid points under it and offset[j] is the number of grid
+# points under the entries before it in the same node. The id of a grid point is the
+# sum of the offsets along its path, and its y values are stored in row id of Grid.y.
+# Each node is also described by its first value, step and length, so that for evenly 
+# spaced levels the neighbors of a query value are found arithmetically. Levels that are 
+# not evenly spaced (the rs level) are searched with np.searchsorted.
+class Level:
+    def __init__(self, nodes, uniform=True):
+        self.xs = np.concatenate(nodes)
+        self.starts = np.zeros(len(nodes)+1, dtype=int)
+        self.starts[1:] = np.cumsum([len(xs) for xs in nodes])
+        self.child = None # for the last level, child=None
+        self.size = None
+        self.offset = None
+        self.uniform = uniform
+        self.ns = np.diff(self.starts)
+        self.mins = self.xs[self.starts[:-1]]
+        maxs = self.xs[self.starts[1:]-1]
+        self.steps = np.where(self.ns > 1, (maxs - self.mins) / np.maximum(self.ns-1, 1), 0.)
+
+    # Index of the node that owns each entry
+    def owner(self):
+        return np.repeat(np.arange(len(self.starts)-1), np.diff(self.starts))
+
+    # Fill size and offset, the next level must have been counted already
+    def count(self, next_level=None):
+        if next_level is None:
+            self.size = np.ones(len(self.xs), dtype=int)
         else:
-            return sum(node.count() for node in self.next)
+            node_size = np.add.reduceat(next_level.size, next_level.starts[:-1])
+            self.size = node_size[self.child]
+        cum = np.cumsum(self.size) - self.size
+        self.offset = cum - cum[self.starts[:-1]][self.owner()]
+        # the offsets made increasing across nodes, used by locate()
+        self.key_base = int(self.size.sum()) + 1
+        self.key = self.owner() * self.key_base + self.offset
+
+    # Entries of the given nodes whose points include the rem-th point of the node
+    def locate(self, node, rem):
+        return np.searchsorted(self.key, node * self.key_base + rem, side='right') - 1
+
+    # Position i of the first entry in node that is larger than my_x, searching from 
+    # the second entry on, so 1 <= i <= n. i == n means my_x is out of range.
+    # node and my_x are arrays of the same length
+    def bracket(self, node, my_x):
+        start, n = self.starts[node], self.ns[node]
+        if not self.uniform:
+            i = np.empty(len(node), dtype=int)
+            for m in np.unique(node):
+                rows = node == m
+                i[rows] = np.searchsorted(self.xs[self.starts[m]:self.starts[m+1]], my_x[rows], side='right')
+            return np.clip(i, 1, n)
+        steps = self.steps[node]
+        i = np.floor((my_x - self.mins[node]) / np.where(steps > 0, steps, 1.)).astype(int) + 1
+        i = np.clip(i, 1, n)
+        # the estimate can be off by one due to round-off
+        up = i < n
+        up[up] = self.xs[start[up] + i[up]] <= my_x[up]
+        i[up] += 1
+        down = i > 1
+        down[down] = self.xs[start[down] + i[down] - 1] > my_x[down]
+        i[down] -= 1
+        return i
+
+# The y values of a grid loaded shell by shell. The points of each r-shell are 
+# contiguous, shell s holds the ids bounds[s]:bounds[s+1]. The y values of a shell
+# are read with loader(s) on the first access, and only the shells flagged in allowed
+# may be accessed. Indexing with an id array or a slice works like indexing the n x 7 array.
+# With max_bytes, at most that many bytes of shells are kept, evicting the least 
+# recently used shells. Accesses are counted in hits and misses
+class Shells:
+    def __init__(self, bounds, dtype, loader, allowed=None, max_bytes=None):
+        self.bounds = bounds
+        self.dtype = np.dtype(dtype)
+        self.shape = (int(bounds[-1]), 7)
+        self.loader = loader
+        self.allowed = np.ones(len(bounds)-1, dtype=bool) if allowed is None else allowed
+        self.max_bytes = max_bytes
+        self.data = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, ids):
+        if isinstance(ids, slice):
+            ids = np.arange(*ids.indices(len(self)))
+        ids = np.asarray(ids, dtype=int)
+        flat = ids.reshape(-1)
+        res = np.empty((len(flat), 7), dtype=self.dtype)
+        shell = np.searchsorted(self.bounds, flat, side='right') - 1
+        for s in np.unique(shell):
+            rows = shell == s
+            res[rows] = self.get(s)[flat[rows] - self.bounds[s]]
+        return res.reshape(ids.shape + (7,))
+
+    def __setitem__(self, ids, values):
+        raise Exception('The y values of a grid loaded by shell are read only!')
+
+    # All y values as an array, e.g. for Grid.save()
+    def __array__(self, dtype=None):
+        y = self[:]
+        return y if dtype is None else y.astype(dtype)
+
+    # The y values of shell s, loaded if needed
+    def get(self, s):
+        if s in self.data:
+            self.hits += 1
+            y = self.data.pop(s)
+            self.data[s] = y
+            return y
+        if not self.allowed[s]:
+            raise Exception('r value out of the loaded r window!')
+        self.misses += 1
+        y = np.asarray(self.loader(s), dtype=self.dtype)
+        self.data[s] = y
+        self.nbytes += y.nbytes
+        # the shell just loaded is kept even if it alone exceeds the budget
+        while self.max_bytes is not None and self.nbytes > self.max_bytes and len(self.data) > 1:
+            old, y_old = self.data.popitem(last=False)
+            self.nbytes -= y_old.nbytes
+            self.evictions += 1
+        return y
+
+    # Keep the y values in dtype, including the shells loaded already
+    def set_dtype(self, dtype):
+        self.dtype = np.dtype(dtype)
+        for s in self.data:
+            self.data[s] = np.asarray(self.data[s], dtype=self.dtype)
+        self.nbytes = sum(y.nbytes for y in self.data.values())
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 
+                'resident_shells': len(self.data), 'resident_mb': self.nbytes / 2.**20}
 
 class Grid:
     # Set the parameters that control the density of the grid points
     # For the meaning of ang_params and ori_params, check the _get_dl() method
     def __init__(self):
-        self.headNode = None
+        self.levels = None
+        self.y = None
         self.n = None
         self.rs = np.concatenate((np.linspace(2.0, 3.5, 15), np.linspace(3.5, 6.0, 9)[1:], np.linspace(6.0, 12.0, 8)[1:]))
         self.ang_params = (0.20, 0.45, 3.8, 0.4)
         self.ori_params = (0.23, 0.45, 3.8, 0.4)
     
-    # Setup the grid structure without assigning the y values
+    # Setup the grid structure. The y values are allocated and set to zero
     def setup(self):
         rs = self.rs
-        node_r = Node(rs)
+        nodes = [[] for i in range(6)]
+        nodes[0].append(rs)
+        theta_child = []
         for r in rs:
             phis = self._discretize_phi(r)
-            node_phi = Node(phis)
-            node_r.next.append(node_phi)
+            nodes[1].append(phis)
             for phi in phis:
                 thetas = self._discretize_theta(r, phi)
-                node_theta = Node(thetas)
-                node_phi.next.append(node_theta)
-                for theta in thetas:
-                    ophi1s = self._discretize_ophi1(r)
-                    node_ophi1 = Node(ophi1s)
-                    node_theta.next.append(node_ophi1)
-                    for ophi1 in ophi1s:
-                        ophi2s = self._discretize_ophi2(r, ophi1)
-                        node_ophi2 = Node(ophi2s)
-                        node_ophi1.next.append(node_ophi2)
-                        for ophi2 in ophi2s:
-                            othetas = self._discretize_otheta(r, ophi1, ophi2)
-                            node_otheta = Node(othetas)
-                            node_ophi2.next.append(node_otheta)
-                            for otheta in othetas:
-                                leaf = Node()
-                                node_otheta.next.append(leaf)
-        self.headNode = node_r
+                nodes[2].append(thetas)
+                # the rotational discretization depends only on r, all translational 
+                # points of a shell share the rotational nodes of the shell
+                theta_child.extend([len(nodes[3])] * len(thetas))
+            ophi1s = self._discretize_ophi1(r)
+            nodes[3].append(ophi1s)
+            for ophi1 in ophi1s:
+                ophi2s = self._discretize_ophi2(r, ophi1)
+                nodes[4].append(ophi2s)
+                for ophi2 in ophi2s:
+                    othetas = self._discretize_otheta(r, ophi1, ophi2)
+                    nodes[5].append(othetas)
+        levels = [Level(nodes[0], uniform=False)] + [Level(level_nodes) for level_nodes in nodes[1:]]
+        for level in levels[:-1]:
+            level.child = np.arange(len(level.xs))
+        levels[2].child = np.array(theta_child, dtype=int)
+        levels[-1].count()
+        for i in reversed(range(5)):
+            levels[i].count(levels[i+1])
+        self.levels = levels
         self.n = self._count()
+        self.y = np.zeros((self.n, 7))
         print "The grid structure is now set up. The grid consists of %d points." % self.n
 
     # carry out interpolation
     def interpolate(self, coor, order=2):
-        return self._interpolate_help(coor, self.headNode, order)
-
-    # recursive helper
-    def _interpolate_help(self, coor, node, order):
-        if not node.next:
-            return node.y
-        my_x = coor[0]
-        coor = coor[1:]
-        if order == 1:
-            neighbors = self._find_neighbors2(node.xs, my_x)
-        elif order == 2:
-            neighbors = self._find_neighbors3(node.xs, my_x)
-        elif order == 3:
-            neighbors = self._find_neighbors4(node.xs, my_x)
-        else:
+        return self.interpolate_batch([coor], order)[0]
+
+    # carry out interpolation for an array of coordinates of shape (N, 6), 
+    # returns an array of shape (N, 7). The queries are processed in chunks to 
+    # bound the memory used by the stencils, which have up to (order+1)**6 points each
+    def interpolate_batch(self, coors, order=2, chunk=None):
+        if order not in (1, 2, 3):
             raise Exception("Invalid order for interpolant. Choose from 1, 2 and 3")
-        xs = []
-        ys = []
-        for i in neighbors:
-            xs.append(node.xs[i])
-            ys.append(self._interpolate_help(coor, node.next[i], order))
-        my_y = self._interp_1D(xs, ys, my_x)
-        fmt = '[' + '%.2f,'*(len(xs)-1) + '%.2f]'
-        return my_y 
+        coors = np.asarray(coors, dtype=float).reshape(-1, 6)
+        if chunk is None:
+            chunk = max(1, 2**20 // (order+1)**6)
+        res = np.empty((len(coors), self.y.shape[1]))
+        # with a memory budget, queries in the same shells go together
+        perm = None
+        if isinstance(self.y, Shells) and self.y.max_bytes is not None and len(coors) > chunk:
+            perm = np.argsort(coors[:, 0], kind='mergesort')
+            coors = coors[perm]
+        for start in range(0, len(coors), chunk):
+            res[start:start+chunk] = self._interpolate_batch_help(coors[start:start+chunk], order)
+        if perm is not None:
+            res[perm] = res.copy()
+        return res
+
+    # Tensor-product Lagrange interpolation. The stencils are expanded level by 
+    # level into one path per stencil point, carrying the product of the 1D 
+    # Lagrange weights along the path. The result of each query is then the 
+    # weighted sum of the y values at the end of its paths, summed in the dtype of y
+    def _interpolate_batch_help(self, coors, order):
+        query = np.arange(len(coors))
+        node = np.zeros(len(coors), dtype=int)
+        base = np.zeros(len(coors), dtype=int)
+        weight = np.ones(len(coors))
+        for i, level in enumerate(self.levels):
+            my_x = coors[query, i]
+            idx, cnt = self._find_neighbors_batch(level, node, my_x, order)
+            mask = np.arange(idx.shape[1]) < cnt[:, None]
+            w = self._lagrange_weights(level.xs[idx], mask, my_x)
+            j = idx[mask]
+            parent = np.repeat(np.arange(len(cnt)), cnt)
+            query = query[parent]
+            base = base[parent] + level.offset[j]
+            weight = weight[parent] * w[mask]
+            if level.child is not None:
+                node = level.child[j]
+        ys = self.y[base] * weight.astype(self.y.dtype)[:, None]
+        # the paths of each query are contiguous
+        starts = np.flatnonzero(np.diff(np.concatenate(([-1], query))))
+        return np.add.reduceat(ys, starts)
+
+    # Store and interpolate the y values in dtype, e.g. np.float32 to halve the memory 
+    # and the memory traffic of the lookups. float32 keeps about seven significant 
+    # digits, close to the six decimals of the values in grid.dat
+    def set_dtype(self, dtype):
+        if isinstance(self.y, Shells):
+            self.y.set_dtype(dtype)
+        else:
+            self.y = np.asarray(self.y, dtype=dtype)
 
     # fill the y values for the grid points with the supplied objective function f
     def fill(self, f):
-        for leaf, x in self._gen_leaves_with_x():
-            leaf.y = f(x)
+        for id, x in enumerate(self.get_x()):
+            self.y[id] = f(x)
 
     # save the grid parameters and y values on each grid point to a text file
     def save(self, filename):
@@ -99,15 +278,18 @@ class Grid:
             file.write(fmt % self.ori_params)
             fmt = 'RS\t' + '%f\t' * (len(self.rs)-1) + '%f\n'
             file.write(fmt % tuple(self.rs))
-            fmt = '%f\t' * 6 + '%f\n'
-            for leaf, x in self._gen_leaves_with_x():
-                if leaf.y == None:
-                    leaf.y = [0.0 for i in range(7)]
-                file.write(fmt % tuple(leaf.y))
+            np.savetxt(file, self.y, fmt='%f', delimiter='\t')
 
     # load the grid parameters from a text file, build the grid structure, then 
-    # load y values for the grid points from the text file
-    def load(self, filename):    
+    # load y values for the grid points from the text file. 
+    # Binary databases written by save_bin() are recognized and passed to load_bin()
+    # With rmin or rmax, only the r-shells needed to interpolate in [rmin, rmax] are
+    # loaded, see load_shells(). lazy and max_mb need a binary database
+    def load(self, filename, rmin=None, rmax=None, lazy=False, max_mb=None):    
+        if self._is_bin(filename):
+            return self.load_bin(filename, rmin=rmin, rmax=rmax, lazy=lazy, max_mb=max_mb)
+        if lazy or max_mb is not None:
+            raise Exception('Lazy loading needs a binary data file, see gridTxt2Bin.py')
         print "Loading y values for each grid point from", filename
         with open(filename) as file:
             for i in range(3):
@@ -121,52 +303,258 @@ class Grid:
                 else:
                     raise Exception('Wrong data file format!')
             self.setup()
-            for leaf, x in self._gen_leaves_with_x():
-                line = file.readline().split()
-                if len(line) != 7:
+            # the file is read shell by shell, with a window only the allowed shells 
+            # are parsed and kept
+            bounds = self.shell_bounds()
+            window = rmin is not None or rmax is not None
+            allowed = self._window_shells(rmin, rmax)
+            if window:
+                ys = {}
+            else:
+                y = np.empty((self.n, 7))
+            for s in range(len(self.rs)):
+                lines = list(itertools.islice(file, bounds[s+1] - bounds[s]))
+                if len(lines) != bounds[s+1] - bounds[s]:
+                    raise Exception('Data file format error!')
+                if not allowed[s]:
+                    continue
+                if window:
+                    ys[s] = self._parse_rows(lines)
+                else:
+                    y[bounds[s]:bounds[s+1]] = self._parse_rows(lines)
+            del lines
+            for line in file:
+                if line.split():
+                    raise Exception('Extra lines in data file!')
+        if window:
+            # the parsed shells are handed over and dropped from ys
+            self.load_shells(ys.pop, np.float64, rmin, rmax)
+        else:
+            self.y = y
+
+    # Parse text lines of 7 values each to an array of shape (len(lines), 7). Every 
+    # line must have exactly 7 fields, which are counted from the starts of the 
+    # non-blank runs of characters
+    def _parse_rows(self, lines):
+        text = ''.join(lines)
+        y = np.fromstring(text, sep=' ')
+        chars = np.frombuffer(text, dtype=np.uint8)
+        blank = chars <= 32
+        starts = np.flatnonzero(blank[:-1] & ~blank[1:]) + 1
+        if len(chars) and not blank[0]:
+            starts = np.concatenate(([0], starts))
+        ends = np.cumsum([len(line) for line in lines])
+        counts = np.bincount(np.searchsorted(ends, starts, side='right'), minlength=len(lines))
+        if len(y) != len(lines) * 7 or len(counts) != len(lines) or np.any(counts != 7):
+            raise Exception('Data file format error!')
+        return y.reshape(-1, 7)
+
+    # save the grid parameters and y values to a binary file, see BIN_HEADER
+    def save_bin(self, filename, dtype=np.float64):
+        dtype = np.dtype(dtype).newbyteorder('<')
+        header = np.zeros(1, dtype=BIN_HEADER)
+        header['magic'] = BIN_MAGIC
+        header['version'] = BIN_VERSION
+        header['ydtype'] = dtype.str
+        header['n'] = self.n
+        header['nrs'] = len(self.rs)
+        header['ang_params'] = self.ang_params
+        header['ori_params'] = self.ori_params
+        with open(filename, 'wb') as file:
+            file.write(header.tostring())
+            file.write(np.asarray(self.rs, dtype='<f8').tostring())
+            file.write('\0' * (self._bin_offset(len(self.rs)) - file.tell()))
+            for start in range(0, self.n, 65536):
+                file.write(np.asarray(self.y[start:start+65536], dtype=dtype).tostring())
+
+    # load a binary file written by save_bin(). With mmap, the y values are mapped
+    # from the file and only read from disk when touched, use mode='r+' to allow 
+    # writing back into the file. With lazy, rmin or rmax, the y values are read 
+    # shell by shell instead, see load_shells(). max_mb bounds the megabytes of shells 
+    # kept in memory, shells are then read on demand and the least recently used 
+    # evicted, see Grid.y.stats() for the hit and miss counts
+    def load_bin(self, filename, mmap=True, mode='r', rmin=None, rmax=None, lazy=False, max_mb=None):
+        print "Loading y values for each grid point from", filename
+        header, rs = self._read_bin_header(filename)
+        self.ang_params = tuple(header['ang_params'])
+        self.ori_params = tuple(header['ori_params'])
+        self.rs = rs
+        self.setup()
+        if self.n != header['n']:
+            raise Exception('Data file format error!')
+        dtype = np.dtype(header['ydtype'])
+        offset = self._bin_offset(len(rs))
+        if lazy or rmin is not None or rmax is not None or max_mb is not None:
+            bounds = self.shell_bounds()
+            def loader(s):
+                with open(filename, 'rb') as file:
+                    file.seek(offset + bounds[s] * 7 * dtype.itemsize)
+                    y = np.fromfile(file, dtype=dtype, count=(bounds[s+1] - bounds[s]) * 7)
+                if len(y) != (bounds[s+1] - bounds[s]) * 7:
                     raise Exception('Data file format error!')
-                leaf.y = np.array([float(entry) for entry in line])
-            line = file.readline().split()
-            if line:
-                raise Exception('Extra lines in data file!')
+                return y.reshape(-1, 7)
+            max_bytes = None if max_mb is None else int(max_mb * 2**20)
+            self.load_shells(loader, dtype, rmin, rmax, lazy or max_bytes is not None, max_bytes)
+        elif mmap:
+            self.y = np.memmap(filename, dtype=dtype, mode=mode, offset=offset, shape=(self.n, 7))
+        else:
+            with open(filename, 'rb') as file:
+                file.seek(offset)
+                y = np.fromfile(file, dtype=dtype, count=self.n*7)
+            if len(y) != self.n * 7:
+                raise Exception('Data file format error!')
+            self.y = y.reshape(self.n, 7)
+
+    # Use the y values of the r-shells read by loader(s), see Shells. Only the shells 
+    # whose interpolation stencils can be reached from r in [rmin, rmax] may be 
+    # accessed. They are loaded right away, or on the first access with lazy. 
+    # max_bytes bounds the memory of the shells kept, see Shells
+    def load_shells(self, loader, dtype, rmin=None, rmax=None, lazy=False, max_bytes=None):
+        allowed = self._window_shells(rmin, rmax)
+        self.y = Shells(self.shell_bounds(), dtype, loader, allowed, max_bytes)
+        if not lazy:
+            for s in np.flatnonzero(allowed):
+                self.y.get(s)
+
+    # Flags of the r-shells whose interpolation stencils can be reached from r in 
+    # [rmin, rmax], all shells without a window
+    def _window_shells(self, rmin=None, rmax=None):
+        allowed = np.ones(len(self.rs), dtype=bool)
+        if rmin is not None or rmax is not None:
+            rmin = self.rs[0] if rmin is None else max(rmin, self.rs[0])
+            rmax = self.rs[-1] if rmax is None else min(rmax, self.rs[-1])
+            first, last = np.searchsorted(self.rs, [rmin, rmax], side='right')
+            # first-1 and last-1 are the shells containing rmin and rmax, the stencils
+            # reach from one shell below to two shells above the shell containing r
+            allowed[:] = False
+            allowed[max(first - 2, 0):last + 2] = True
+        return allowed
+
+    # Ids of the first point of each r-shell and the number of points, the points
+    # of shell s are bounds[s]:bounds[s+1]
+    def shell_bounds(self):
+        return np.append(self.levels[0].offset, self.n)
+
+    def _read_bin_header(self, filename):
+        with open(filename, 'rb') as file:
+            header = np.fromfile(file, dtype=BIN_HEADER, count=1)
+            if len(header) != 1 or header['magic'][0] != BIN_MAGIC:
+                raise Exception('Wrong data file format!')
+            header = header[0]
+            if header['version'] != BIN_VERSION:
+                raise Exception('Unsupported data file version %d!' % header['version'])
+            rs = np.fromfile(file, dtype='<f8', count=header['nrs'])
+        return header, rs
+
+    # Byte offset of the y block
+    def _bin_offset(self, nrs):
+        size = BIN_HEADER.itemsize + 8 * nrs
+        return (size + BIN_ALIGN - 1) // BIN_ALIGN * BIN_ALIGN
+
+    def _is_bin(self, filename):
+        with open(filename, 'rb') as file:
+            return file.read(len(BIN_MAGIC)) == BIN_MAGIC
+
+    # Coordinates of the grid points with the given ids, an id array of any shape 
+    # gives an array of coordinates with an extra last dimension of length 6
+    def id2x(self, ids):
+        ids = np.asarray(ids, dtype=int)
+        if np.any((ids < 0) | (ids >= self.n)):
+            raise Exception('Grid point id out of range!')
+        rem = ids.reshape(-1)
+        x = np.empty((len(rem), 6))
+        node = np.zeros(len(rem), dtype=int)
+        for i, level in enumerate(self.levels):
+            j = level.locate(node, rem)
+            x[:, i] = level.xs[j]
+            rem = rem - level.offset[j]
+            if level.child is not None:
+                node = level.child[j]
+        return x.reshape(ids.shape + (6,))
+
+    # Ids of the grid points at the given coordinates, the inverse of id2x() 
+    def x2id(self, coors, eps=1.E-6):
+        coors = np.asarray(coors, dtype=float)
+        flat = coors.reshape(-1, 6)
+        ids = np.zeros(len(flat), dtype=int)
+        node = np.zeros(len(flat), dtype=int)
+        for i, level in enumerate(self.levels):
+            my_x = flat[:, i]
+            start, n = level.starts[node], level.ns[node]
+            k = level.bracket(node, my_x) - 1
+            # my_x can be slightly below the grid value
+            up = k + 1 < n
+            up[up] = np.abs(level.xs[start[up] + k[up] + 1] - my_x[up]) < eps
+            j = start + k + up
+            if np.any(np.abs(level.xs[j] - my_x) > eps):
+                raise Exception('Coordinate not on the grid!')
+            ids += level.offset[j]
+            if level.child is not None:
+                node = level.child[j]
+        return ids.reshape(coors.shape[:-1])
+
+    # Coordinates of the grid points with ids in range(start, stop), all points by 
+    # default, as an array of shape (stop-start, 6) in point order
+    def get_x(self, start=0, stop=None):
+        if stop is None:
+            stop = self.n
+        if start == 0 and stop == self.n:
+            return self._expand_levels(6)[0]
+        return self.id2x(np.arange(start, stop))
+
+    # Coordinates of the translational points with the rotational coordinates set 
+    # to zero, as an array of shape (ntrans, 6)
+    def get_grid_x(self):
+        x = self._expand_levels(3)[0]
+        return np.column_stack((x, np.zeros((len(x), 3))))
+
+    # Expand the first nlevel levels into one row of coordinates per path, in point 
+    # order. Returns the coordinates and the node each path leads to on the next level
+    def _expand_levels(self, nlevel):
+        x = np.zeros((1, 0))
+        node = np.zeros(1, dtype=int)
+        for level in self.levels[:nlevel]:
+            n = level.ns[node]
+            parent = np.repeat(np.arange(len(node)), n)
+            j = np.arange(len(parent)) - np.repeat(np.cumsum(n) - n, n) + level.starts[node][parent]
+            x = np.column_stack((x[parent], level.xs[j]))
+            if level.child is not None:
+                node = level.child[j]
+        return x, node
 
     # Generate x values for all points
     def gen_x(self):
-        for leaf, x in self._gen_leaves_with_x_help(self.headNode, []):
+        for x in self.get_x():
             yield x
 
-    # Generate node leaves together with their x values, used by fill()
-    def _gen_leaves_with_x(self):
-        for leaf, x in self._gen_leaves_with_x_help(self.headNode, []):
-            yield leaf, x
-
-    # recursive helper
-    def _gen_leaves_with_x_help(self, node, pre_x):
-        if not node.next:
-            yield node, pre_x
-            return
-        for i in range(len(node.next)):
-            for _ in self._gen_leaves_with_x_help(node.next[i], pre_x+[node.xs[i]]):
-                yield _
-
     def gen_grid_x(self):
-        for grid, x in self._gen_grids_with_x_help(self.headNode, []):
+        for x in self.get_grid_x():
             yield x
 
-    def _gen_grids_with_x(self):
-        for grid, x in self._gen_grids_with_x_help(self.headNode, []):
-            yield grid, x
-
-    def _gen_grids_with_x_help(self, node, pre_x, level = 3):
-        if level == 0:
-            yield node, pre_x + [0., 0., 0.]
-            return
-        for i in range(len(node.next)):
-            for _ in self._gen_grids_with_x_help(node.next[i], pre_x+[node.xs[i]], level - 1):
-                yield _
     # Count the total number of points in the grid
     def _count(self):
-        return self.headNode.count()
+        return int(self.levels[0].size.sum())
+
+    # Count the points of each r-shell from the discretization formulas, without 
+    # setting up the grid. Returns two integer arrays with the numbers of translational 
+    # (phi, theta) and rotational (ophi1, ophi2, otheta) points of each shell, the 
+    # number of grid points in a shell is their product
+    def count_shells(self):
+        ntrans = np.zeros(len(self.rs), dtype=int)
+        nori = np.zeros(len(self.rs), dtype=int)
+        for k, r in enumerate(self.rs):
+            dl = self._get_dl(r, self.ang_params)
+            phis = self._discretize_phi(r)
+            ntrans[k] = self._n_points(np.pi * np.cos(phis), dl).sum()
+            dl = self._get_dl(r, self.ori_params)
+            for ophi1 in self._discretize_ophi1(r):
+                ophi2s = self._discretize_ophi2(r, ophi1)
+                nori[k] += self._n_points(2 * np.pi * np.cos(ophi1) * np.cos(ophi2s), dl).sum()
+        return ntrans, nori
+
+    # Number of points used to discretize a range of length l, as in the methods below
+    def _n_points(self, l, dl):
+        return np.maximum(1, np.ceil(l/dl)).astype(int)
 
     # Use a 4-parameter sigmoidal function to calculate the approximate distance between two points 
     # on the 3D sphere for angular DOFs or 4D sphere for rotational DOFs.
@@ -241,83 +629,51 @@ class Grid:
             #return np.linspace(mini-da, maxi+da, n+2)
             return np.linspace(mini, maxi, n)
 
-    # The following methods carries out 1D neighbor search for the query value
-    # attention: need better range check
-
-    # Two points for linear interpolation
-    def _find_neighbors2(self, xs, my_x):
-        n = len(xs)
-        if n <= 2:
-            return range(len(xs))
-        i = 1
-        while i < n:
-            if xs[i] > my_x:
-                break
-            i += 1
-        if i == n:
-            print xs, my_x
-            raise Exception("x value out of range!")
-        return [i-1, i]
-
-    # Three points for 2nd order interpolation
-    def _find_neighbors3(self, xs, my_x):
-        n = len(xs)
-        if n <= 3:
-            return range(len(xs))
-        i = 1
-        while i < n:
-            if xs[i] > my_x:
-                break
-            i += 1
-        if i == n:
-            raise Exception("x value out of range!")
-        if i < 2:
-            return [i-1, i, i+1]
-        if i > n - 2:
-            return [i-2, i-1, i]
-        return [i-1, i, i+1]
-
-    # Four points for 3rd order interpolation
-    def _find_neighbors4(self, xs, my_x):
-        n = len(xs)
-        if n < 4:
-            return range(len(xs))
-        i = 1
-        while i < n:
-            if xs[i] > my_x:
-                break
-            i += 1
-        if i == n:
+    # Neighbor search for many queries at once. The i-th query is carried out in the 
+    # given node[i] of level. With x[k-1] <= my_x < x[k] in the node of n points, the 
+    # stencil is
+    #   order 1: the 2 points k-1, k
+    #   order 2: the 3 points k-1, k, k+1, shifted to k-2, k-1, k at the upper edge 
+    #            (k == n-1)
+    #   order 3: the 4 points k-2 to k+1, only the 3 points 0, 1, 2 at the lower edge
+    #            (k == 1) and n-3, n-2, n-1 at the upper edge (k == n-1)
+    # Nodes of at most min(order+1, 3) points use all their points, for larger nodes
+    # my_x must be below the last point of the node.
+    # Returns the stencils as indices into level.xs, padded to width order+1, and 
+    # the number of valid points in each stencil
+    def _find_neighbors_batch(self, level, node, my_x, order):
+        start, n = level.starts[node], level.ns[node]
+        i = level.bracket(node, my_x)
+        first = i - 1
+        cnt = np.full(len(node), order+1, dtype=int)
+        if order == 2:
+            first[i == n-1] -= 1
+        elif order == 3:
+            first -= 1
+            edge = (i == 1) | (i == n-1)
+            first[i == 1] = 0
+            first[i == n-1] = n[i == n-1] - 3
+            cnt[edge] = 3
+        small = n <= min(order+1, 3)
+        if np.any((i == n) & ~small):
             raise Exception("x value out of range!")
-        if i == 1:
-            return [0, 1, 2]
-        if i == n-1:
-            return [n-3, n-2, n-1]
-        return [i-2, i-1, i, i+1]
-
-    # Carries out 1D Lagrange interpolation
-    # choose the order of the interpolant based on the number of points
-    def _interp_1D(self, xs, ys, my_x):
-        if len(xs) == 1:
-            return ys[0]
-        if len(xs) == 2:
-            x0, x1 = xs
-            y0, y1 = ys
-            return y0 + (my_x - x0) * (y1 - y0) / (x1 - x0)
-        if len(xs) == 3:
-            x0, x1, x2 = xs
-            y0, y1, y2 = ys
-            a1 = (y1 - y0) / (x1 - x0)
-            a2 = (y2 - y0 - a1 * (x2 - x0)) / (x2 - x0) / (x2 - x1)
-            return y0 + a1 * (my_x - x0) + a2 * (my_x - x0) * (my_x - x1)
-        if len(xs) == 4:
-            x0, x1, x2, x3 = xs
-            y0, y1, y2, y3 = ys
-            a1 = (y1 - y0) / (x1 - x0)
-            a2 = (y2 - y0 - a1 * (x2 - x0)) / (x2 - x0) / (x2 - x1)
-            a3 = (y3 - y0 - a1 * (x3 - x0) - a2 * (x3 - x0) * (x3 - x1)) / (x3 - x0) / (x3 - x1) / (x3 - x2)
-            return y0 + a1 * (my_x - x0) + a2 * (my_x - x0) * (my_x - x1) + \
-                    a3 * (my_x - x0) * (my_x - x1) * (my_x - x2)
+        first[small] = 0
+        cnt[small] = n[small]
+        idx = np.minimum(first[:, None] + np.arange(order+1), n[:, None] - 1) + start[:, None]
+        return idx, cnt
+
+    # Weights of the 1D Lagrange interpolants on the stencils xs of shape (P, K) 
+    # at my_x, only the first points of each stencil flagged in mask are used 
+    def _lagrange_weights(self, xs, mask, my_x):
+        w = np.where(mask, 1., 0.)
+        for k in range(xs.shape[1]):
+            for m in range(xs.shape[1]):
+                if m == k:
+                    continue
+                valid = mask[:, k] & mask[:, m]
+                d = np.where(valid, xs[:, k] - xs[:, m], 1.)
+                w[:, k] *= np.where(valid, (my_x - xs[:, m]) / d, 1.)
+        return w
             
 
     
@@ -1,8 +1,13 @@
 #!/usr/bin/env python2
+# Usage: gridLoadAndSaveQM.py loglist [grid.bin [nproc]]
+# With a binary database name, the logs are harvested in parallel directly 
+# into the binary database instead of being saved to grid.dat. Rerunning with 
+# a longer loglist only ingests the logs of points not filled yet
 import numpy as np
 from eft_calculator import EFT_calculator, Water
 import tools
 import sys
+import multiprocessing
 from time import time
 
 qmLogList = sys.argv[1]
@@ -10,6 +15,14 @@ calculator = EFT_calculator()
 t1 = time()
 calculator.setup()
 t2 = time()
+if len(sys.argv) > 2:
+    nproc = multiprocessing.cpu_count()
+    if len(sys.argv) > 3:
+        nproc = int(sys.argv[3])
+    calculator.harvest_QM(qmLogList, sys.argv[2], nproc)
+    t3 = time()
+    print('took %.1fs, %.1fs s to setup and harvest'%(t2-t1, t3-t2))
+    sys.exit()
 calculator.fill_with_QM(qmLogList)
 t3 = time()
 calculator.grid.save("grid.dat")
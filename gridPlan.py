@@ -0,0 +1,77 @@
+#!/usr/bin/env python2
+# Size a grid before setting it up: number of points in total and per r-shell, 
+# number of QM jobs and estimated size of the database, computed from the 
+# discretization formulas with Grid.count_shells(). A parameter can be swept over a
+# range to compare settings, e.g. the 400k/900k/1.7M-style grids.
+import sys
+import argparse
+import numpy as np
+from grid import Grid
+
+# bytes per point of a text database as written by Grid.save, 7 '%f' values like 
+# '-12.345678' each followed by a tab or the newline
+TXT_BYTES_PER_POINT = 7 * (len('-12.345678') + 1)
+
+def plan(grid):
+    """Return a dict with the numbers of points and the estimated database sizes of grid"""
+    ntrans, nori = grid.count_shells()
+    nshell = ntrans * nori
+    n = int(nshell.sum())
+    header = grid._bin_offset(len(grid.rs))
+    return {'n': n,
+            'jobs': n, # one QM job per grid point
+            'ntrans': ntrans,
+            'nori': nori,
+            'nshell': nshell,
+            'txt_bytes': 256 + 10 * len(grid.rs) + n * TXT_BYTES_PER_POINT,
+            'bin64_bytes': header + n * 7 * 8,
+            'bin32_bytes': header + n * 7 * 4}
+
+def argparser():
+    parser = argparse.ArgumentParser(description="Estimate the size of a grid without building it")
+    parser.add_argument("--ang", type=float, nargs=4, help="ang_params: dl0 dl1 r0 s")
+    parser.add_argument("--ori", type=float, nargs=4, help="ori_params: dl0 dl1 r0 s")
+    parser.add_argument("--rs", type=float, nargs='+', help="r values of the shells")
+    parser.add_argument("--shells", action='store_true', help="print the points of each r-shell")
+    parser.add_argument("--sweep", nargs=5, metavar=('PRM', 'INDEX', 'START', 'STOP', 'NUM'), 
+                        help="sweep entry INDEX of PRM (ang or ori) over np.linspace(START, STOP, NUM)")
+    return parser
+
+def grid_from_args(args):
+    grid = Grid()
+    if args.ang:
+        grid.ang_params = tuple(args.ang)
+    if args.ori:
+        grid.ori_params = tuple(args.ori)
+    if args.rs:
+        grid.rs = np.array(args.rs)
+    return grid
+
+def print_plan(grid, res):
+    MB = 1024. ** 2
+    print("ANGPRM %s ORIPRM %s: %d points, %d QM jobs, text %.1f MB, binary %.1f MB (float64) %.1f MB (float32)" % (
+          '%.3f %.3f %.3f %.3f' % grid.ang_params, '%.3f %.3f %.3f %.3f' % grid.ori_params, 
+          res['n'], res['jobs'], res['txt_bytes'] / MB, res['bin64_bytes'] / MB, res['bin32_bytes'] / MB))
+
+if __name__ == '__main__':
+    parser = argparser()
+    args = parser.parse_args()
+    grid = grid_from_args(args)
+    if not args.sweep:
+        res = plan(grid)
+        print_plan(grid, res)
+        if args.shells:
+            print("%8s %8s %8s %10s" % ('r', 'trans', 'rot', 'points'))
+            for r, nt, no, ns in zip(grid.rs, res['ntrans'], res['nori'], res['nshell']):
+                print("%8.3f %8d %8d %10d" % (r, nt, no, ns))
+        sys.exit()
+    name, index = args.sweep[0], int(args.sweep[1])
+    if name not in ('ang', 'ori'):
+        parser.error("PRM should be ang or ori")
+    if not 0 <= index < 4:
+        parser.error("INDEX should be 0 to 3")
+    for value in np.linspace(*[float(v) for v in args.sweep[2:4]] + [int(args.sweep[4])]):
+        params = list(getattr(grid, name + '_params'))
+        params[index] = value
+        setattr(grid, name + '_params', tuple(params))
+        print_plan(grid, plan(grid))
@@ -0,0 +1,41 @@
+#!/usr/bin/env python2
+# Usage: gridTriageQM.py loglist [start stop [nproc]]
+# Classify every expected grid point id as done, missing, failed (no E(MP2)=) or 
+# incomplete (no gradient block) from the GAMESS logs in loglist, write a compact 
+# report to triage.txt and the input files of the points to be rerun to rerun.list
+import sys
+import multiprocessing
+import numpy as np
+from eft_calculator import EFT_calculator, input_name
+
+# Compress sorted ids to ranges like '0-99 150 200-210'
+def id_ranges(ids):
+    if not len(ids):
+        return ''
+    breaks = np.nonzero(np.diff(ids) != 1)[0]
+    firsts = np.concatenate(([ids[0]], ids[breaks + 1]))
+    lasts = np.concatenate((ids[breaks], [ids[-1]]))
+    return ' '.join(str(a) if a == b else '%d-%d' % (a, b) for a, b in zip(firsts, lasts))
+
+start = stop = None
+nproc = multiprocessing.cpu_count()
+if len(sys.argv) > 3:
+    start, stop = int(sys.argv[2]), int(sys.argv[3])
+if len(sys.argv) > 4:
+    nproc = int(sys.argv[4])
+calculator = EFT_calculator()
+calculator.setup()
+triage = calculator.triage_QM(sys.argv[1], start, stop, nproc)
+total = sum(len(ids) for ids in triage.values())
+with open('triage.txt', 'w') as report:
+    for status in ('done', 'missing', 'failed', 'incomplete'):
+        line = '%-10s %10d %6.2f%%' % (status, len(triage[status]), 100.0 * len(triage[status]) / max(total, 1))
+        print(line)
+        report.write(line + '\n')
+    for status in ('missing', 'failed', 'incomplete'):
+        report.write('%s: %s\n' % (status, id_ranges(triage[status])))
+rerun = np.sort(np.concatenate([triage[s] for s in ('missing', 'failed', 'incomplete')]))
+with open('rerun.list', 'w') as f:
+    for id in rerun:
+        f.write(input_name(id) + '\n')
+print('%d of %d points to rerun, see triage.txt and rerun.list' % (len(rerun), total))
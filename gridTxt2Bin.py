@@ -0,0 +1,23 @@
+#!/usr/bin/env python2
+# Convert a text grid database (e.g. grid.dat) to the binary format that 
+# Grid.load() maps into memory with numpy.memmap
+# Usage: gridTxt2Bin.py grid.dat grid.bin [float32]
+import sys
+import numpy as np
+from time import time
+from grid import Grid
+
+if len(sys.argv) < 3:
+    print("\n       Usage:#0 grid.dat grid.bin [float64|float32]\n")
+    sys.exit()
+txtName, binName = sys.argv[1:3]
+dtype = np.float64
+if len(sys.argv) == 4:
+    dtype = np.dtype(sys.argv[3])
+grid = Grid()
+t1 = time()
+grid.load(txtName)
+t2 = time()
+grid.save_bin(binName, dtype)
+t3 = time()
+print('took %.1fs, %.1fs to load and convert' % (t2-t1, t3-t2))
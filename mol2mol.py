@@ -524,9 +524,13 @@ def WriteGJF(file_h, coords):
     file_h.write("\n")
     return
     
-def WriteINP(file_h, coords):
-    file_h.write("! Gamess input file generated by mol2mol.\n")
-    file_h.write(GAMESS_Settings)
+def WriteINP(file_h, coords, settings=None):
+    # settings is a GAMESS input header like GAMESS_Settings, the default
+    if settings is None:
+        file_h.write("! Gamess input file generated by mol2mol.\n")
+        file_h.write(GAMESS_Settings)
+    else:
+        file_h.write(settings)
     for atom in coords:
         file_h.write("%2s" % atom[0])
         if atom[0].upper() in ZCharge: 
@@ -541,6 +545,20 @@ def WriteINP(file_h, coords):
     file_h.write(" $END\n")    
     return
 
+def RenderINPs(coords, ele, settings=None):
+    """ GAMESS input texts as written by WriteINP for an array of molecules of shape 
+    (N, natom, 3) with elements ele, with the coordinates formatted as %15.8f.
+    One template is formatted per molecule instead of one line per atom. """
+    if settings is None:
+        settings = "! Gamess input file generated by mol2mol.\n" + GAMESS_Settings
+    template = settings.replace('%', '%%')
+    for e in ele:
+        if e.upper() not in ZCharge:
+            print "!!!Warning: There are special elements with no atom No. assigned!!!"
+        template += "%2s%8s" % (e, ZCharge.get(e.upper(), "X")) + "%15.8f%15.8f%15.8f\n"
+    template += " $END\n"
+    return [template % tuple(mol) for mol in coords.reshape(len(coords), -1).tolist()]
+
 def WritePDB(file_h, coords, IsWrtTitle=True, NdxAtom=1, NameRes='LIG', NdxRes=1):
     if IsWrtTitle:
         file_h.write('TITLE     THIS PDB FILE IS GENERATED BY "mol2mol" --lfzhao.\n')
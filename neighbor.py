@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+import itertools
+import numpy as np
+
+
+# Enumerate the pairs of points closer than cutoff by binning the points into cells 
+# with edges of at least cutoff, so that only points in the same or adjacent cells need 
+# to be compared. The cost grows linearly with the number of points at constant density.
+# X has shape (N, 3). For an orthorhombic periodic box, give its edge lengths in box, 
+# distances then follow the minimum image convention, which requires cutoff <= box/2.
+# Returns two index arrays i, j with i < j, sorted by i then j.
+def cell_pairs(X, cutoff, box=None):
+    X = np.asarray(X, dtype=float)
+    if len(X) < 2:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    if box is None:
+        origin = X.min(axis=0)
+        cell = np.floor((X - origin) / cutoff).astype(int)
+        dims = cell.max(axis=0) + 1
+        shifts = [(-1, 0, 1)] * 3
+    else:
+        box = np.asarray(box, dtype=float)
+        if np.any(cutoff > box / 2):
+            raise Exception('Cutoff %.2f larger than half the box!' % cutoff)
+        dims = np.floor(box / cutoff).astype(int)
+        X = X - box * np.floor(X / box)
+        cell = np.minimum(np.floor(X / (box / dims)).astype(int), dims - 1)
+        # with less than 3 cells along an edge the periodic neighbors coincide
+        shifts = [(-1, 0, 1) if n >= 3 else range(n) for n in dims]
+    # only the occupied cells are binned, so that far apart points in an open cluster
+    # do not cost memory for the empty cells between them
+    if float(np.prod(dims.astype(float))) > 2.**62:
+        raise Exception('Points too far apart for the cell list!')
+    cell_id = _cell_key(cell, dims)
+    occupied, inverse = np.unique(cell_id, return_inverse=True)
+    order = np.argsort(inverse, kind='mergesort')
+    count = np.bincount(inverse)
+    first = np.cumsum(count) - count
+    iss, jss = [], []
+    for offset in itertools.product(*shifts):
+        nb = cell + np.array(offset)
+        if box is None:
+            inside = np.all((nb >= 0) & (nb < dims), axis=1)
+        else:
+            nb %= dims
+            inside = np.ones(len(nb), dtype=bool)
+        i = np.flatnonzero(inside)
+        nb_id = _cell_key(nb[inside], dims)
+        pos = np.minimum(np.searchsorted(occupied, nb_id), len(occupied) - 1)
+        found = occupied[pos] == nb_id
+        i, j = _expand(i[found], first[pos[found]], count[pos[found]], order)
+        keep = i < j
+        iss.append(i[keep])
+        jss.append(j[keep])
+    i = np.concatenate(iss)
+    j = np.concatenate(jss)
+    d = displacements(X, i, j, box)
+    keep = np.einsum('ij,ij->i', d, d) < cutoff**2
+    i, j = i[keep], j[keep]
+    order = np.lexsort((j, i))
+    return i[order], j[order]
+
+# Displacements X[j] - X[i], folded to the minimum image for a periodic box
+def displacements(X, i, j, box=None):
+    d = X[j] - X[i]
+    if box is not None:
+        box = np.asarray(box, dtype=float)
+        d -= box * np.round(d / box)
+    return d
+
+# Flat index of the cells in a grid of dims cells
+def _cell_key(cell, dims):
+    cell = cell.astype(np.int64)
+    return (cell[:, 0] * int(dims[1]) + cell[:, 1]) * int(dims[2]) + cell[:, 2]
+
+# Pair every point in i with the points order[first:first+count] of its neighbor cell
+def _expand(i, first, count, order):
+    i = np.repeat(i, count)
+    pos = np.arange(len(i)) - np.repeat(np.cumsum(count) - count, count)
+    j = order[np.repeat(first, count) + pos]
+    return i, j
+
+
+# A Verlet neighbor list. The pairs within cutoff + skin are enumerated with a 
+# cell list and kept until some point has moved by more than skin/2 since, after
+# which the list is rebuilt. In between, update() only needs to check the distances
+# of the listed pairs.
+class Verlet_list:
+    def __init__(self, cutoff, skin=1.0, box=None):
+        self.cutoff = cutoff
+        self.skin = skin
+        self.box = box
+        self.X0 = None
+        self.i = None
+        self.j = None
+        self.nbuild = 0 # number of times the list has been built
+
+    # Returns the pairs within cutoff for the points X of shape (N, 3), as index
+    # arrays i, j with i < j and the displacements X[j] - X[i] of shape (npairs, 3)
+    def update(self, X):
+        X = np.asarray(X, dtype=float)
+        if self._need_build(X):
+            self.build(X)
+        d = displacements(X, self.i, self.j, self.box)
+        keep = np.einsum('ij,ij->i', d, d) < self.cutoff**2
+        return self.i[keep], self.j[keep], d[keep]
+
+    def build(self, X):
+        self.i, self.j = cell_pairs(X, self.cutoff + self.skin, self.box)
+        self.X0 = np.array(X, dtype=float)
+        self.nbuild += 1
+
+    def _need_build(self, X):
+        if self.X0 is None or len(X) != len(self.X0):
+            return True
+        d = X - self.X0
+        if self.box is not None:
+            d -= self.box * np.round(d / self.box)
+        return np.einsum('ij,ij->i', d, d).max() > (self.skin / 2)**2
@@ -0,0 +1,62 @@
+#!/usr/bin/env python2
+# Compare the grid interpolation with the y values stored and summed in float32 
+# against float64, and report the largest deviations of energy, force and torque 
+# on the random test set test.dat/random of test_eft_calculator.py, or on npairs 
+# random pairs if the test set is not there
+# Usage: testFloat32.py grid.dat [npairs [order]]
+import os
+import sys
+import numpy as np
+from time import time
+from eft_calculator import EFT_calculator
+
+def load_coordinates(name):
+    lines = open('test.dat/random/'+name).readlines()[-7:-1]
+    coors = [[float(item) for item in line.split()[2:5]] for line in lines]
+    return np.array(coors)
+
+def test_set(calculator, npairs):
+    if os.path.exists('test.dat/random'):
+        Xq = [[calculator.mol.atomic2Xq(coors[:3]), calculator.mol.atomic2Xq(coors[3:])] 
+              for coors in (load_coordinates('test%04d.inp' % i) for i in range(2, 2000))]
+        X0 = np.array([x0 for (x0, q0), (x1, q1) in Xq])
+        q0 = np.array([q0 for (x0, q0), (x1, q1) in Xq])
+        X1 = np.array([x1 for (x0, q0), (x1, q1) in Xq])
+        q1 = np.array([q1 for (x0, q0), (x1, q1) in Xq])
+        return X0, q0, X1, q1
+    rng = np.random.RandomState(0)
+    rs = calculator.grid.rs
+    u = rng.randn(npairs, 3)
+    r = rng.uniform(rs[0], rs[-1], npairs)
+    X1 = u / np.linalg.norm(u, axis=1)[:, None] * r[:, None]
+    q0 = rng.randn(npairs, 4)
+    q1 = rng.randn(npairs, 4)
+    q0 /= np.linalg.norm(q0, axis=1)[:, None]
+    q1 /= np.linalg.norm(q1, axis=1)[:, None]
+    return np.zeros((npairs, 3)), q0, X1, q1
+
+if len(sys.argv) < 2:
+    print("\n       Usage:#0 grid.dat [npairs [order]]\n")
+    sys.exit()
+npairs = 10000
+order = 2
+if len(sys.argv) > 2:
+    npairs = int(sys.argv[2])
+if len(sys.argv) > 3:
+    order = int(sys.argv[3])
+calculator = EFT_calculator(order)
+calculator.setup(sys.argv[1])
+X0, q0, X1, q1 = test_set(calculator, npairs)
+results = {}
+for dtype in (np.float64, np.float32):
+    calculator.grid.set_dtype(dtype)
+    t1 = time()
+    results[dtype] = calculator.eval_batch(X0, q0, X1, q1)
+    t2 = time()
+    print('%s: %.1f MB of y values, took %.2f s for %d pairs' % (np.dtype(dtype).name, 
+          calculator.grid.y.nbytes / 2.**20, t2 - t1, len(X0)))
+d = results[np.float32] - results[np.float64]
+print('max deviation of energy %.3e, force %.3e, torque %.3e' % (np.abs(d[:, 0]).max(), 
+      np.linalg.norm(d[:, 1:4], axis=1).max(), np.linalg.norm(d[:, 4:7], axis=1).max()))
+print('max |energy| %.3e, |force| %.3e, |torque| %.3e' % (np.abs(results[np.float64][:, 0]).max(), 
+      np.linalg.norm(results[np.float64][:, 1:4], axis=1).max(), np.linalg.norm(results[np.float64][:, 4:7], axis=1).max()))
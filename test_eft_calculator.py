@@ -2,7 +2,10 @@
 
 import numpy as np
 from time import time
+import multiprocessing
 import heapq
+import shutil
+import tempfile
 from matplotlib import pyplot as plt
 
 from eft_calculator import EFT_calculator, Water
@@ -110,7 +113,10 @@ if __name__ == '__main__':
     cc = Classical_calculator()
     #calculator.setup('grid_data.txt')
     calculator.setup()
-    calculator.fill_grid(cc)
+    # fill from scratch, chunks of an earlier run may be from another setup
+    chunk_dir = tempfile.mkdtemp(prefix='grid_data.chunks.')
+    calculator.fill_grid(cc, nproc=multiprocessing.cpu_count(), chunk_dir=chunk_dir)
+    shutil.rmtree(chunk_dir)
     t1 = time()
     print 'took %.1f s to fill the grid' % (t1 - t0)
     test_random_set()
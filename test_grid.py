@@ -0,0 +1,209 @@
+#!/usr/bin/env python2
+
+import numpy as np
+
+from eft_calculator import EFT_calculator, Water
+from grid import Grid, Level
+
+
+# Check the batched grid code against the scalar paths on a small grid with random y
+rng = np.random.RandomState(11)
+
+def small_calculator(order=2):
+    calculator = EFT_calculator(order)
+    grid = calculator.grid
+    grid.rs = np.array([2.0, 2.5, 3.0, 4.0, 5.0, 6.0])
+    grid.ang_params = (0.5, 0.9, 3.8, 0.4)
+    grid.ori_params = (0.6, 0.9, 3.8, 0.4)
+    grid.setup()
+    grid.y = rng.randn(grid.n, 7)
+    return calculator
+
+def random_q(n):
+    q = rng.randn(n, 4)
+    return q / np.linalg.norm(q, axis=1)[:, None]
+
+# Random pairs with COM distances within the r range of the small grid
+def random_pairs(n):
+    u = rng.randn(n, 3)
+    X0 = rng.uniform(-5, 5, (n, 3))
+    X1 = X0 + u / np.linalg.norm(u, axis=1)[:, None] * rng.uniform(2.05, 5.95, n)[:, None]
+    return X0, random_q(n), X1, random_q(n)
+
+def assert_close(a, b, eps=1.E-12):
+    assert np.abs(np.asarray(a) - np.asarray(b)).max() < eps
+
+def test_eval_batch():
+    calculator = small_calculator()
+    X0, q0, X1, q1 = random_pairs(200)
+    for order in (1, 2, 3):
+        calculator.order = order
+        assert_close(calculator.eval_batch(X0, q0, X1, q1), 
+                     [calculator.eval(X0[k], q0[k], X1[k], q1[k]) for k in range(len(X0))])
+
+# The stencil rules of Grid._find_neighbors_batch for one query in a node xs
+def ref_stencil(xs, x, order):
+    n = len(xs)
+    if n <= min(order+1, 3):
+        return range(n)
+    k = 1
+    while k < n and xs[k] <= x:
+        k += 1
+    if k == n:
+        raise Exception("x value out of range!")
+    if order == 1:
+        return [k-1, k]
+    if order == 2:
+        return [k-2, k-1, k] if k == n-1 else [k-1, k, k+1]
+    if k == 1:
+        return [0, 1, 2]
+    if k == n-1:
+        return [n-3, n-2, n-1]
+    return [k-2, k-1, k, k+1]
+
+# Tensor-product Lagrange interpolation by recursion over the levels, one query at a time
+def ref_interpolate(grid, coor, order, i=0, node=0, base=0):
+    level = grid.levels[i]
+    xs = level.xs[level.starts[node]:level.starts[node+1]]
+    stencil = ref_stencil(xs, coor[i], order)
+    res = np.zeros(7)
+    for k in stencil:
+        w = 1.
+        for m in stencil:
+            if m != k:
+                w *= (coor[i] - xs[m]) / (xs[k] - xs[m])
+        j = level.starts[node] + k
+        if level.child is None:
+            res += w * grid.y[base + level.offset[j]]
+        else:
+            res += w * ref_interpolate(grid, coor, order, i+1, level.child[j], base + level.offset[j])
+    return res
+
+def test_stencils():
+    grid = Grid()
+    level = Level([np.linspace(0., 4., 5), np.array([0., 1.]), np.array([0., 1., 2.]), np.array([0.3])])
+    def stencil(node, x, order):
+        idx, cnt = grid._find_neighbors_batch(level, np.array([node]), np.array([x]), order)
+        mask = np.arange(idx.shape[1]) < cnt[:, None]
+        w = grid._lagrange_weights(level.xs[idx], mask, np.array([x]))
+        return list(idx[0, :cnt[0]] - level.starts[node]), list(w[0, :cnt[0]])
+    # order 1: the bracketing pair
+    assert stencil(0, 2.25, 1) == ([2, 3], [0.75, 0.25])
+    # order 2: shifted down at the upper edge, 1D Lagrange weights on 2, 3, 4 at 3.5
+    assert stencil(0, 1.5, 2)[0] == [1, 2, 3]
+    assert stencil(0, 3.5, 2) == ([2, 3, 4], [-0.125, 0.75, 0.375])
+    assert stencil(0, 0.5, 2)[0] == [0, 1, 2]
+    # order 3: 4 points inside, 3 points at either edge
+    assert stencil(0, 1.5, 3) == ([0, 1, 2, 3], [-0.0625, 0.5625, 0.5625, -0.0625])
+    assert stencil(0, 0.5, 3) == ([0, 1, 2], [0.375, 0.75, -0.125])
+    assert stencil(0, 3.5, 3) == ([2, 3, 4], [-0.125, 0.75, 0.375])
+    # small nodes use all their points
+    assert stencil(1, 0.25, 2) == ([0, 1], [0.75, 0.25])
+    assert stencil(2, 0.5, 3) == ([0, 1, 2], [0.375, 0.75, -0.125])
+    assert stencil(3, 0.3, 3) == ([0], [1.])
+    try:
+        stencil(0, 4., 2)
+        assert False
+    except Exception as e:
+        assert 'out of range' in str(e)
+
+def test_interpolate():
+    grid = small_calculator().grid
+    coors = np.column_stack((rng.uniform(2.0, 6.0, 300), rng.uniform(0, np.pi/2, 300), 
+                             rng.uniform(0, np.pi, 300), rng.uniform(0, np.pi/2, 300), 
+                             rng.uniform(0, np.pi/2, 300), rng.uniform(-np.pi, np.pi, 300)))
+    for order in (1, 2, 3):
+        assert_close(grid.interpolate_batch(coors, order), [ref_interpolate(grid, c, order) for c in coors])
+
+def test_interpolate_on_grid():
+    # queries on grid values, which are out of range at the upper edge of a node
+    grid = small_calculator().grid
+    xs = grid.get_x()
+    ntested = 0
+    for order in (1, 2, 3):
+        for id in rng.choice(grid.n, 200, replace=False):
+            try:
+                ref = ref_interpolate(grid, xs[id], order)
+            except Exception:
+                ref = None
+            try:
+                res = grid.interpolate(xs[id], order)
+            except Exception:
+                res = None
+            assert (ref is None) == (res is None)
+            if ref is not None:
+                assert_close(res, ref)
+                assert_close(res, grid.y[id])
+                ntested += 1
+    assert ntested > 100
+
+def test_ids():
+    grid = small_calculator().grid
+    ids = np.arange(grid.n)
+    xs = grid.id2x(ids)
+    assert np.array_equal(grid.x2id(xs), ids)
+    assert np.array_equal(grid.get_x(), xs)
+    assert np.array_equal(grid.get_x(100, 400), xs[100:400])
+    assert np.array_equal(np.array(list(grid.gen_x())), xs)
+    assert grid.id2x(ids[:14].reshape(2, 7)).shape == (2, 7, 6)
+    # off the grid
+    try:
+        grid.x2id(xs[5] + [0., 0., 0., 0., 0., 0.01])
+        assert False
+    except Exception as e:
+        assert 'not on the grid' in str(e)
+
+# Energy, force and torque about its COM of the second water in coors, from point 
+# charges and a Lennard-Jones term between the oxygens
+class Analytic_calculator:
+    def eval(self, coors):
+        return analytic_eft(coors)
+
+def analytic_eft(coors):
+    charge = np.array([-0.834, 0.417, 0.417])
+    coor0, coor1 = coors[:3], coors[3:]
+    com1 = Water().getCOM(coor1)
+    e, f, t = 0., np.zeros(3), np.zeros(3)
+    for i in range(3):
+        for j in range(3):
+            d = coor1[j] - coor0[i]
+            r = np.linalg.norm(d)
+            ener = 138.935456 * charge[i] * charge[j] / r
+            force = ener / r**2 * d
+            if i == 0 and j == 0:
+                sor6 = (3.4 / r)**6
+                ener += 0.12 * (sor6**2 - 2 * sor6)
+                force += 12 * 0.12 / r**2 * sor6 * (sor6 - 1) * d
+            e += ener
+            f += force
+            t += np.cross(coor1[j] - com1, force)
+    return np.array([e, f[0], f[1], f[2], t[0], t[1], t[2]])
+
+def test_reaction():
+    mol = Water()
+    X0, q0, X1, q1 = random_pairs(50)
+    # the reaction formula of eval_batch_both holds for the analytic model
+    for k in range(len(X0)):
+        c0, c1 = mol.Xq2Atomic(X0[k], q0[k]), mol.Xq2Atomic(X1[k], q1[k])
+        eft1 = analytic_eft(np.concatenate((c0, c1)))
+        eft0 = analytic_eft(np.concatenate((c1, c0)))
+        assert_close(eft0[1:4], -eft1[1:4], 1.E-10)
+        assert_close(eft0[4:7], -eft1[4:7] - np.cross(X1[k] - X0[k], eft1[1:4]), 1.E-10)
+    # and eval_batch_both applies it to the interpolated EFT of mol1
+    calculator = small_calculator()
+    calculator.grid.y = calculator._eval_atomic(Analytic_calculator(), calculator.grid.get_x())
+    eft, ft0 = calculator.eval_batch_both(X0, q0, X1, q1)
+    assert_close(eft, calculator.eval_batch(X0, q0, X1, q1))
+    assert_close(ft0[:, 0:3], -eft[:, 1:4])
+    # no net torque about the origin
+    total = ft0[:, 3:6] + eft[:, 4:7] + np.cross(X0, ft0[:, 0:3]) + np.cross(X1, eft[:, 1:4])
+    assert_close(total, 0., 1.E-9)
+    e, f = calculator.eval_both(X0[0], q0[0], X1[0], q1[0])
+    assert_close(f, ft0[0])
+
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print('%s passed' % name)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python2
+
+import numpy as np
+
+import neighbor
+
+
+# Check the pairs of neighbor.py against all pairs by brute force
+rng = np.random.RandomState(3)
+
+def brute_pairs(X, cutoff, box=None):
+    d = X[None, :] - X[:, None]
+    if box is not None:
+        d -= box * np.round(d / box)
+    r2 = np.einsum('ijk,ijk->ij', d, d)
+    return np.nonzero(np.triu(r2 < cutoff**2, 1))
+
+def assert_same_pairs(pairs, ref):
+    i, j = pairs[:2]
+    assert np.array_equal(i, ref[0]) and np.array_equal(j, ref[1])
+
+def test_open():
+    X = rng.uniform(-5, 35, (700, 3))
+    for cutoff in (3., 7.9, 50.):
+        assert_same_pairs(neighbor.cell_pairs(X, cutoff), brute_pairs(X, cutoff))
+
+def test_periodic():
+    # edges of 2, 3 and more cells, and points outside the box to be folded in
+    for box in ([27., 40., 60.], [20., 20., 20.], [31., 31., 31.]):
+        box = np.array(box)
+        X = rng.uniform(-1, 2, (600, 3)) * box
+        for cutoff in (4., 9., 10.):
+            i, j = neighbor.cell_pairs(X, cutoff, box)
+            assert_same_pairs((i, j), brute_pairs(X, cutoff, box))
+            # no pair twice
+            assert len(set(zip(i, j))) == len(i)
+
+def test_small():
+    assert len(neighbor.cell_pairs(np.zeros((1, 3)), 3.)[0]) == 0
+    X = np.array([[0., 0., 0.], [0., 0., 2.9]])
+    assert_same_pairs(neighbor.cell_pairs(X, 3., np.array([10., 10., 10.])), ([0], [1]))
+    # across the periodic boundary
+    X = np.array([[0.5, 5., 5.], [9.5, 5., 5.]])
+    assert_same_pairs(neighbor.cell_pairs(X, 3., np.array([10., 10., 10.])), ([0], [1]))
+    assert len(neighbor.cell_pairs(X, 3.)[0]) == 0
+
+def test_far_outlier():
+    # the cells between a cluster and a far away point are not allocated
+    X = np.concatenate((rng.uniform(0, 10, (50, 3)), [[1.E4, 2.E4, -3.E4]]))
+    assert_same_pairs(neighbor.cell_pairs(X, 3.), brute_pairs(X, 3.))
+    X[-1] = [5., 5., 1.E7]
+    assert_same_pairs(neighbor.cell_pairs(X, 3.), brute_pairs(X, 3.))
+
+def test_verlet():
+    for box in (None, np.array([30., 30., 30.])):
+        vl = neighbor.Verlet_list(6., 1.0, box)
+        X = rng.uniform(0, 30, (600, 3))
+        for step in range(40):
+            X += rng.randn(*X.shape) * 0.05
+            i, j, d = vl.update(X)
+            assert_same_pairs((i, j), brute_pairs(X, 6., box))
+            assert np.abs(d - neighbor.displacements(X, i, j, box)).max() < 1.E-12
+        assert 1 < vl.nbuild < 40
+
+def test_verlet_rebuild():
+    vl = neighbor.Verlet_list(6., 1.0, np.array([30., 30., 30.]))
+    X = rng.uniform(0, 30, (200, 3))
+    vl.update(X)
+    # a move below half the skin keeps the list, across the boundary too
+    X[0] += [0.49, 0., 0.]
+    X[1] += [30., 0., 0.]
+    vl.update(X)
+    assert vl.nbuild == 1
+    X[2] += [0., 0.51, 0.]
+    vl.update(X)
+    assert vl.nbuild == 2
+
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print('%s passed' % name)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python2
+
+import numpy as np
+
+import tools
+
+
+# Check the array versions of the functions in tools.py against the scalar ones
+N = 1000
+rng = np.random.RandomState(7)
+
+def random_q(n=N):
+    q = rng.randn(n, 4)
+    return q / np.linalg.norm(q, axis=1)[:, None]
+
+def assert_close(a, b, eps=1.E-12):
+    assert np.abs(np.asarray(a) - np.asarray(b)).max() < eps
+
+def test_qmult():
+    a, b = random_q(), random_q()
+    assert_close(tools.qmult_batch(a, b), [tools.qmult(a[i], b[i]) for i in range(N)])
+    assert_close(tools.qmult_batch(a, b[0]), [tools.qmult(a[i], b[0]) for i in range(N)])
+
+def test_qinv_qdiv():
+    a, b = random_q(), random_q()
+    assert_close(tools.qinv_batch(a), [tools.qinv(a[i]) for i in range(N)])
+    assert_close(tools.qdiv_batch(a, b), [tools.qdiv(a[i], b[i]) for i in range(N)])
+
+def test_qmirror():
+    M = np.diag([1., -1., 1.])
+    q = random_q()
+    assert_close(tools.qmirror_batch(M, q), [tools.qmirror(M, q[i]) for i in range(N)])
+
+def test_q2R_R2q():
+    q = random_q()
+    R = tools.q2R_batch(q)
+    assert_close(R, [tools.q2R(q[i]) for i in range(N)])
+    assert_close(tools.R2q_batch(R), [tools.R2q(R[i]) for i in range(N)])
+    # round trip up to the sign of q
+    q1 = tools.R2q_batch(R)
+    assert all(tools.qequal(q[i], q1[i]) for i in range(N))
+    # the four branches of R2q
+    for R in [np.eye(3), np.diag([1., -1., -1.]), np.diag([-1., 1., -1.]), np.diag([-1., -1., 1.])]:
+        assert_close(tools.R2q_batch(R[None])[0], tools.R2q(R))
+
+def test_spherical():
+    X = rng.randn(N, 3) * 5
+    r, phi, theta = tools.xyz2spherical_batch(X)
+    assert_close(np.column_stack((r, phi, theta)), [tools.xyz2spherical(X[i]) for i in range(N)])
+    assert_close(tools.spherical2xyz_batch(r, phi, theta), [tools.spherical2xyz(r[i], phi[i], theta[i]) for i in range(N)])
+    assert_close(tools.spherical2xyz_batch(r, phi, theta), X)
+
+def test_q_spherical():
+    q = random_q()
+    phi1, phi2, theta = tools.q2spherical_batch(q)
+    assert_close(np.column_stack((phi1, phi2, theta)), [tools.q2spherical(q[i]) for i in range(N)])
+    assert_close(tools.spherical2q_batch(phi1, phi2, theta), [tools.spherical2q(phi1[i], phi2[i], theta[i]) for i in range(N)])
+    assert_close(tools.spherical2q_batch(phi1, phi2, theta), np.where(q[:, :1] < 0, -q, q))
+
+def test_leading_dims():
+    q = random_q(12).reshape(3, 4, 4)
+    assert tools.q2R_batch(q).shape == (3, 4, 3, 3)
+    assert_close(tools.R2q_batch(tools.q2R_batch(q)), tools.R2q_batch(tools.q2R_batch(q.reshape(12, 4))).reshape(3, 4, 4))
+
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print('%s passed' % name)
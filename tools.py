@@ -110,3 +110,105 @@ def spherical2q(phi1, phi2, theta):
     q3 = np.cos(phi1) * np.cos(phi2) * np.cos(theta)
     return np.array([q0, q1, q2, q3])
 
+
+
+# Array versions of the functions above. Quaternions, vectors and rotation matrices
+# are stacked along leading dimensions, i.e. q has shape (..., 4), X has shape 
+# (..., 3) and R has shape (..., 3, 3). Spherical coordinates are returned as 
+# separate arrays of the leading shape.
+
+def qmirror_batch(M, q):
+    q = np.asarray(q, dtype=float)
+    newq = np.array(q)
+    newq[...,1:] = - np.einsum('...ij,...j->...i', M, q[...,1:])
+    return newq
+
+def qmult_batch(a, b):
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    q = np.empty(np.broadcast(a, b).shape)
+    q[...,0] = a[...,0]*b[...,0] - a[...,1]*b[...,1] - a[...,2]*b[...,2] - a[...,3]*b[...,3]
+    q[...,1] = a[...,0]*b[...,1] + a[...,1]*b[...,0] - a[...,2]*b[...,3] + a[...,3]*b[...,2]
+    q[...,2] = a[...,0]*b[...,2] + a[...,2]*b[...,0] + a[...,1]*b[...,3] - a[...,3]*b[...,1]
+    q[...,3] = a[...,0]*b[...,3] + a[...,3]*b[...,0] - a[...,1]*b[...,2] + a[...,2]*b[...,1]
+    return q
+
+def qinv_batch(q):
+    q = np.array(q, dtype=float)
+    q[...,0] = -q[...,0]
+    return q
+
+def qdiv_batch(a, b):
+    return qmult_batch(a, qinv_batch(b))
+
+def q2R_batch(q):
+    q = np.asarray(q, dtype=float)
+    q0, q1, q2, q3 = q[...,0], q[...,1], q[...,2], q[...,3]
+    R = np.empty(q.shape[:-1] + (3, 3))
+    R[...,0,0] = 1-2*q2**2-2*q3**2
+    R[...,0,1] = 2*(q1*q2-q3*q0)
+    R[...,0,2] = 2*(q1*q3+q2*q0)
+    R[...,1,0] = 2*(q1*q2+q3*q0)
+    R[...,1,1] = 1-2*q1**2-2*q3**2
+    R[...,1,2] = 2*(q2*q3-q1*q0)
+    R[...,2,0] = 2*(q1*q3-q2*q0)
+    R[...,2,1] = 2*(q2*q3+q1*q0)
+    R[...,2,2] = 1-2*q1**2-2*q2**2
+    return R
+
+# Selects the largest of the four candidate components with argmax and picks the 
+# signs of the others from a table of the four cases, instead of branching
+def R2q_batch(R):
+    R = np.asarray(R, dtype=float)
+    R00, R11, R22 = R[...,0,0], R[...,1,1], R[...,2,2]
+    q = np.stack([( R00 + R11 + R22 + 1.) / 4.,
+                  ( R00 - R11 - R22 + 1.) / 4.,
+                  (-R00 + R11 - R22 + 1.) / 4.,
+                  (-R00 - R11 + R22 + 1.) / 4.], axis=-1)
+    q = np.sqrt(np.maximum(q, 0.))
+    s21 = np.sign(R[...,2,1] - R[...,1,2])
+    s02 = np.sign(R[...,0,2] - R[...,2,0])
+    s10 = np.sign(R[...,1,0] - R[...,0,1])
+    p10 = np.sign(R[...,1,0] + R[...,0,1])
+    p02 = np.sign(R[...,0,2] + R[...,2,0])
+    p21 = np.sign(R[...,2,1] + R[...,1,2])
+    one = np.ones(R.shape[:-2])
+    signs = np.stack([np.stack([one, s21, s02, s10], axis=-1),
+                      np.stack([s21, one, p10, p02], axis=-1),
+                      np.stack([s02, p10, one, p21], axis=-1),
+                      np.stack([s10, p02, p21, one], axis=-1)], axis=-2)
+    k = np.argmax(q, axis=-1)
+    sign = np.take_along_axis(signs, k[...,None,None], axis=-2)[...,0,:]
+    q *= sign
+    q /= np.linalg.norm(q, axis=-1)[...,None]
+    return q
+
+def xyz2spherical_batch(X):
+    X = np.asarray(X, dtype=float)
+    x, y, z = X[...,0], X[...,1], X[...,2]
+    r = np.sqrt(x**2 + y**2 + z**2)
+    phi = np.arctan2(z, np.sqrt(x**2 + y**2))
+    theta = np.arctan2(y, x)
+    return r, phi, theta
+
+def spherical2xyz_batch(r, phi, theta):
+    x = r * np.cos(phi) * np.cos(theta)
+    y = r * np.cos(phi) * np.sin(theta)
+    z = r * np.sin(phi)
+    return np.stack(np.broadcast_arrays(x, y, z), axis=-1)
+
+def q2spherical_batch(q):
+    q = np.asarray(q, dtype=float)
+    q = np.where(q[...,:1] < 0, -q, q)
+    q0, q1, q2, q3 = q[...,0], q[...,1], q[...,2], q[...,3]
+    theta = np.arctan2(q2, q3)
+    phi2 = np.arctan2(q1, np.sqrt(q2**2 + q3**2))
+    phi1 = np.arctan2(q0, np.sqrt(q1**2 + q2**2 + q3**2))
+    return phi1, phi2, theta
+
+def spherical2q_batch(phi1, phi2, theta):
+    q0 = np.sin(phi1)
+    q1 = np.cos(phi1) * np.sin(phi2)
+    q2 = np.cos(phi1) * np.cos(phi2) * np.sin(theta)
+    q3 = np.cos(phi1) * np.cos(phi2) * np.cos(theta)
+    return np.stack(np.broadcast_arrays(q0, q1, q2, q3), axis=-1)